@@ -35,6 +35,32 @@ def _run_tests(configs, head_data, body_data, debug=False):
   assert 'dataTables' in response.json()
   assert 'dataTablesAdditions' in response.json()
 
+  for endpoint in ["/", "/config", "/render.js", "/style.css"]:
+    url = f"{base}{endpoint}"
+    _log_test_title(f"{url} with and without compression and If-None-Match")
+    response = requests.get(url, headers={"Accept-Encoding": "identity"})
+    assert response.status_code == 200
+    assert 'Content-Encoding' not in response.headers
+    etag = response.headers['ETag']
+    content = response.content
+
+    response = requests.get(url, headers={"Accept-Encoding": "gzip"})
+    assert response.status_code == 200
+    assert response.content == content
+    if 'Content-Encoding' in response.headers:
+      # Compressed forms have their own ETag
+      assert response.headers['Content-Encoding'] == "gzip"
+      assert response.headers['ETag'] != etag
+
+    headers = {"Accept-Encoding": "identity", "If-None-Match": etag}
+    response = requests.get(url, headers=headers)
+    assert response.status_code == 304
+    assert response.headers['ETag'] == etag
+
+    headers = {"Accept-Encoding": "identity", "If-None-Match": '"other"'}
+    response = requests.get(url, headers=headers)
+    assert response.status_code == 200
+
   url = f"{base}/data/"
   _log_test_title(url)
   response = requests.get(url)
@@ -58,6 +84,19 @@ def _run_tests(configs, head_data, body_data, debug=False):
   assert 'data' in response.json()
   assert list(response.json()['data'][0].keys()) == head_data
 
+  if 'jsondb' in config:
+    url = f"{base}/jsondb"
+    _log_test_title(url)
+    response = requests.get(url)
+    assert response.status_code == 200
+    assert response.json()['columns'] == head_data
+    assert response.json()['data'] == body_data
+    etag = response.headers['ETag']
+
+    _log_test_title(f"{url} with If-None-Match: {etag}")
+    response = requests.get(url, headers={'If-None-Match': etag})
+    assert response.status_code == 304
+
   if 'sqldb' in config:
     url = f"{base}/data/?_start=0&_length=2&_draw=10"
     _log_test_title(url)
@@ -73,6 +112,21 @@ def _run_tests(configs, head_data, body_data, debug=False):
       for j in range(len(head_data)):
         assert response.json()['data'][i][j] == body_data[i][j]
 
+    url = f"{base}/data/?_start=0&_length=-1"
+    _log_test_title(url)
+    response = requests.get(url)
+    assert response.status_code == 200
+    assert response.json()['recordsTotal'] == len(body_data)
+    assert response.json()['recordsFiltered'] == len(body_data)
+    assert response.json()['data'] == body_data
+
+    url = f"{base}/data/?_start=2&_length=-1&{head_data[0]}=a_1"
+    _log_test_title(url)
+    response = requests.get(url)
+    assert response.status_code == 200
+    assert response.json()['recordsFiltered'] == 2
+    assert response.json()['data'] == []
+
     url = f"{base}/data/?_orders=-{head_data[0]}"
     _log_test_title(url)
     response = requests.get(url)
@@ -100,6 +154,40 @@ def _run_tests(configs, head_data, body_data, debug=False):
       for j in range(len(head_data)):
         assert response.json()['data'][i][j] == body_data[i+_start][j]
 
+    _length = 3
+    url = f"{base}/data/?_keyset=true&_length={_length}&_orders=-{head_data[0]}"
+    _log_test_title(url)
+    response = requests.get(url)
+    assert response.status_code == 200
+    assert response.json()['start'] == 0
+    assert response.json()['cursors']['prev'] is None
+    pages = [response.json()['data']]
+    while response.json()['cursors']['next'] is not None:
+      cursor = response.json()['cursors']['next']
+      url = f"{base}/data/?_cursor={cursor}&_length={_length}&_orders=-{head_data[0]}"
+      _log_test_title(url)
+      response = requests.get(url)
+      assert response.status_code == 200
+      assert response.json()['recordsFiltered'] == len(body_data)
+      pages.append(response.json()['data'])
+    rows = [row for page in pages for row in page]
+    assert len(rows) == len(body_data)
+    for i in range(len(body_data)):
+      assert rows[i] == body_data[len(body_data)-1-i]
+
+    cursor = response.json()['cursors']['prev']
+    url = f"{base}/data/?_cursor={cursor}&_length={_length}&_orders=-{head_data[0]}"
+    _log_test_title(url)
+    response = requests.get(url)
+    assert response.status_code == 200
+    assert response.json()['data'] == pages[-2]
+
+    url = f"{base}/data/?_cursor={cursor}&_length={_length}&_orders={head_data[0]}"
+    _log_test_title(url)
+    response = requests.get(url)
+    assert response.status_code == 400
+    assert 'error' in response.json()
+
     cols = f"{head_data[0]},{head_data[2]}"
     url = f"{base}/data/?_return={cols}"
     _log_test_title(url)
@@ -127,6 +215,29 @@ def _run_tests(configs, head_data, body_data, debug=False):
     response.json()['data'][0]['a'] == body_data[0][0]
     response.json()['data'][0]['c'] == body_data[0][2]
 
+    url = f"{base}/data/?_format=columnar&_start=0&_length=100"
+    _log_test_title(url)
+    response = requests.get(url)
+    assert response.status_code == 200
+    assert response.json()['recordsFiltered'] == len(body_data)
+    assert list(response.json()['data'].keys()) == head_data
+    for j, col in enumerate(head_data):
+      assert response.json()['data'][col] == [row[j] for row in body_data]
+
+    url = f"{base}/data/?_format=columnar&_dictionary=true&_return={head_data[1]}"
+    _log_test_title(url)
+    response = requests.get(url)
+    assert response.status_code == 200
+    values = response.json()['data'][head_data[1]]
+    if isinstance(values, dict):
+      values = [values['dictionary'][i] for i in values['indices']]
+    assert values == [row[1] for row in body_data]
+
+    url = f"{base}/data/?_format=columnar&_verbose=true"
+    _log_test_title(url)
+    response = requests.get(url)
+    assert response.status_code == 400
+
     url = f"{base}/data/?a=a01"
     _log_test_title(url)
     response = requests.get(url)
@@ -190,6 +301,18 @@ def _run_tests(configs, head_data, body_data, debug=False):
     response.json()['data'][0]['c'] == body_data[0][2]
 
 
+    for globalsearch in ['a01', 'c1', '1', 'B0']:
+      url = f"{base}/data/?_globalsearch={globalsearch}&_start=0&_length=100"
+      _log_test_title(url)
+      response = requests.get(url)
+      assert response.status_code == 200
+      n_expected = 0
+      for row in body_data:
+        if any(globalsearch.lower() in str(val).lower() for val in row):
+          n_expected += 1
+      assert response.json()['recordsFiltered'] == n_expected
+      assert len(response.json()['data']) == n_expected
+
     def check_uniques(data, head_data, body_data, cols=None):
       if cols is None:
         cols = head_data
@@ -259,6 +382,760 @@ def _run_tests(configs, head_data, body_data, debug=False):
   utilrsw.uvicorn.stop(process)
 
 
+def _pool_tests():
+
+  # Connections to a database are reused by execute(), at most pool_size
+  # are open at once, and they are replaced when the database is replaced.
+
+  import sqlite3
+  import tempfile
+
+  import tableui
+
+  sql = tableui.sql
+
+  with tempfile.TemporaryDirectory() as tmp_dir:
+    sqldb = os.path.join(tmp_dir, 'pool.sqlite')
+    tableui.list2sql("t", [["a1", "b1"]], ["a", "b"], out=sqldb)
+    sql.configure(sqldb, pool_size=2, streams=1)
+    pool = sql._POOLS[os.path.abspath(sqldb)]
+
+    logger.info("Testing reuse of pooled connections")
+    assert sql.execute(sqldb, "SELECT a FROM t") == [("a1",)]
+    assert len(pool['idle']) == 1
+    connection = pool['idle'][0]
+    assert sql.execute(sqldb, "SELECT b FROM t") == [("b1",)]
+    assert pool['idle'] == [connection]
+
+    logger.info("Testing pool_size and streams limits")
+    with sql._connection(sqldb), sql._connection(sqldb):
+      try:
+        with sql.timeout(0.1):
+          sql.execute(sqldb, "SELECT a FROM t")
+        assert False, "Expected TimeoutError"
+      except TimeoutError:
+        pass
+      # Streams do not use the pool's connections
+      batches = sql.iterate(sqldb, "SELECT a FROM t")
+      assert list(batches) == [[("a1",)]]
+    assert len(pool['idle']) == 2
+
+    logger.info("Testing pooled connections after the database is replaced")
+    tableui.list2sql("t", [["a2", "b2"]], ["a", "b"], out=sqldb)
+    assert sql.execute(sqldb, "SELECT a FROM t") == [("a2",)]
+    assert len(pool['idle']) == 1
+    assert pool['idle'][0] is not connection
+    try:
+      connection.execute("SELECT 1")
+      assert False, "Expected connection to old database to be closed"
+    except sqlite3.ProgrammingError:
+      pass
+
+
+def _nrows_tests():
+
+  # Results of tableui.sql.nrows() are cached until the database changes.
+
+  import tempfile
+
+  import tableui
+
+  sql = tableui.sql
+
+  with tempfile.TemporaryDirectory() as tmp_dir:
+    sqldb = os.path.join(tmp_dir, 'nrows.sqlite')
+    body = [[f"a{i}", i % 2] for i in range(10)]
+    tableui.list2sql("t", body, ["a", "b"], out=sqldb, types={"b": "INTEGER"})
+    sql.nrows_cache_clear()
+
+    logger.info("Testing cache hits of nrows()")
+    assert sql.nrows(sqldb, "t") == 10
+    assert sql.nrows(sqldb, "t") == 10
+    assert sql.nrows(sqldb, "t", clause="WHERE b = ?", params=[1]) == 5
+    assert sql.nrows(sqldb, "t", clause="WHERE  b = ?", params=[1]) == 5
+    assert sql.nrows(sqldb, "t", clause="WHERE b = ?", params=[0]) == 5
+    info = sql.nrows_cache_info()
+    assert (info['hits'], info['misses'], info['size']) == (2, 3, 3)
+
+    logger.info("Testing nrows() after rows are appended and the database is replaced")
+    tableui.list2sql("t", [["a10", 1]], ["a", "b"], out=sqldb, mode="append")
+    assert sql.nrows(sqldb, "t") == 11
+    assert sql.nrows(sqldb, "t", clause="WHERE b = ?", params=[1]) == 6
+    tableui.list2sql("t", body[0:4], ["a", "b"], out=sqldb)
+    assert sql.nrows(sqldb, "t") == 4
+    assert sql.nrows_cache_info()['misses'] == 6
+
+
+def _uniques_tests():
+
+  # tableui.sql.uniques() with limit returns the most frequent values first,
+  # with ties ordered by value.
+
+  import tempfile
+
+  import tableui
+
+  sql = tableui.sql
+
+  head = ["a", "b"]
+  body = [["x", "1"], ["z", "1"], ["y", "2"], ["x", "2"], ["w", "2"], ["z", "3"], ["x", "3"], ["y", "3"]]
+
+  with tempfile.TemporaryDirectory() as tmp_dir:
+    sqldb = os.path.join(tmp_dir, 'uniques.sqlite')
+    tableui.list2sql("t", body, head, out=sqldb)
+
+    logger.info("Testing uniques() with limit")
+    assert sql.uniques(sqldb, "t", "a", limit=3) == [("x", 3), ("y", 2), ("z", 2)]
+    assert sql.uniques(sqldb, "t", "a") == [("w", 1), ("x", 3), ("y", 2), ("z", 2)]
+
+    data = sql.uniques(sqldb, "t", ["a", "b"], limit=2)
+    assert list(data.keys()) == ["a", "b"]
+    assert data["a"] == [("x", 3), ("y", 2)]
+    assert data["b"] == [("2", 3), ("3", 3)]
+
+    data = sql.uniques(sqldb, "t", ["b", "a"], clause="WHERE a != ?", params=["x"], limit=1)
+    assert data == {"b": [("2", 2)], "a": [("y", 2)]}
+
+
+def _executor_tests(configs):
+
+  # /data/ requests that take longer than query_timeout get a 504, and
+  # requests beyond the executor's workers + queue get a 503.
+
+  import tempfile
+  import concurrent.futures
+
+  import tableui
+  import utilrsw.uvicorn
+
+  base = f"http://127.0.0.1:{configs['server']['--port']}"
+
+  with tempfile.TemporaryDirectory() as tmp_dir:
+    # Large enough that a global search takes more than query_timeout
+    sqldb = os.path.join(tmp_dir, 'slow.sqlite')
+    body = ([f"a{i}", f"b{i}", f"c{i}", str(i)] for i in range(200000))
+    tableui.list2sql("slow", body, ["a", "b", "c", "d"], out=sqldb)
+
+    config = [
+      {"path": "timeout", "table_name": "slow", "sqldb": sqldb, "query_timeout": 0.01},
+      {"path": "busy", "table_name": "slow", "sqldb": sqldb}
+    ]
+    app_config = {
+      "executor": {"workers": 1, "queue": 0},
+      "config": config
+    }
+    app_config_file = os.path.join(tmp_dir, 'app.json')
+    with open(app_config_file, 'w') as f:
+      json.dump(app_config, f)
+    configs['app']['config'] = app_config_file
+
+    wait = {
+      "url": f"{base}/busy/config",
+      "retries": 10,
+      "delay": 0.5
+    }
+    process = utilrsw.uvicorn.start('tableui.app', configs, wait=wait)
+
+    try:
+      url = f"{base}/timeout/data/?_start=0&_length=5&_globalsearch=zz"
+      _log_test_title(url)
+      response = requests.get(url)
+      assert response.status_code == 504
+      assert 'error' in response.json()
+
+      # Values differ so that responses are not from the response cache
+      urls = [f"{base}/busy/data/?_start=0&_length=5&_globalsearch=zz{i}" for i in range(8)]
+      _log_test_title(f"{len(urls)} concurrent requests of {base}/busy/data/")
+      with concurrent.futures.ThreadPoolExecutor(max_workers=len(urls)) as pool:
+        responses = list(pool.map(requests.get, urls))
+      status_codes = [response.status_code for response in responses]
+      assert set(status_codes) == {200, 503}
+      for response in responses:
+        if response.status_code == 503:
+          assert response.headers['Retry-After'] == "1"
+    finally:
+      utilrsw.uvicorn.stop(process)
+
+
+def _index_tests(configs, head_file, body_file):
+
+  # Indexes proposed by tableui.sql.advise() from the query_log written by
+  # the server and indexes created by tableui.sql.create_indexes().
+
+  import sqlite3
+  import tempfile
+
+  import tableui
+  import utilrsw.uvicorn
+
+  sql = tableui.sql
+  base = f"http://127.0.0.1:{configs['server']['--port']}"
+
+  def index_names(sqldb):
+    conn = sqlite3.connect(sqldb)
+    try:
+      rows = conn.execute("SELECT name FROM sqlite_master WHERE type = 'index' ORDER BY name")
+      return [row[0] for row in rows]
+    finally:
+      conn.close()
+
+  with tempfile.TemporaryDirectory() as tmp_dir:
+    sqldb = os.path.join(tmp_dir, 'index.sqlite')
+    query_log = os.path.join(tmp_dir, 'queries.log')
+    tableui.list2sql("demo", body_file, head_file, out=sqldb, types={'d': 'INTEGER'})
+    configs['app']['config'] = {"table_name": "demo", "sqldb": sqldb, "query_log": query_log}
+
+    wait = {
+      "url": f"{base}/config",
+      "retries": 10,
+      "delay": 0.5
+    }
+    process = utilrsw.uvicorn.start('tableui.app', configs, wait=wait)
+
+    try:
+      # Values differ so that responses are not from the response cache,
+      # which are not logged
+      queries = [f"b='b0{i}'&_orders=-d" for i in range(1, 4)]
+      queries += [f"d=>{i}" for i in range(5, 7)] + ["_uniques=true&_return=c"]
+      for query in queries:
+        url = f"{base}/data/?{query}&_start=0&_length=5"
+        _log_test_title(url)
+        response = requests.get(url)
+        assert response.status_code == 200
+    finally:
+      utilrsw.uvicorn.stop(process)
+
+    logger.info("Testing advise() and create_indexes()")
+    with open(query_log) as f:
+      assert len(f.readlines()) == len(queries)
+
+    advice = sql.advise(sqldb, "demo", query_log)
+    assert advice == [({'columns': ['b', 'd']}, 3), ({'columns': ['d']}, 2), ({'columns': ['c']}, 1)]
+    sql.create_indexes(sqldb, "demo", [spec for spec, _ in advice])
+    assert index_names(sqldb) == ['demo.idx.b.d', 'demo.idx.c', 'demo.idx.d', 'idx0']
+    assert sql.advise(sqldb, "demo", query_log) == []
+
+    conn = sqlite3.connect(sqldb)
+    try:
+      plan = conn.execute("EXPLAIN QUERY PLAN SELECT * FROM demo WHERE b = ? ORDER BY d DESC", ["b01"]).fetchall()
+    finally:
+      conn.close()
+    assert "demo.idx.b.d" in str(plan)
+
+    indexes = [["b", "c"], {"columns": ["c"], "include": ["a"], "collate": "NOCASE"}, "c"]
+    sql.create_indexes(sqldb, "demo", indexes)
+    names = ['demo.idx.b.c', 'demo.idx.b.d', 'demo.idx.c', 'demo.idx.c.include.a.nocase', 'demo.idx.d', 'idx0']
+    assert index_names(sqldb) == names
+
+
+def _bulk_tests():
+
+  # tableui.sql.write() with a generator of rows inserted in batches.
+
+  import sqlite3
+  import tempfile
+
+  import tableui
+
+  sql = tableui.sql
+
+  def rows(n, bad=None):
+    for i in range(n):
+      if i == bad:
+        yield [f"a{i}"]
+      else:
+        yield [f"a{i}", str(i)]
+
+  with tempfile.TemporaryDirectory() as tmp_dir:
+    sqldb = os.path.join(tmp_dir, 'bulk.sqlite')
+
+    logger.info("Testing write() with a generator and batch_size = 7")
+    sql.write("t", ["a", "b"], rows(100), sqldb, types={"b": "INTEGER"}, batch_size=7)
+    conn = sqlite3.connect(sqldb)
+    try:
+      assert conn.execute("SELECT COUNT(*), SUM(b) FROM t").fetchall() == [(100, 4950)]
+      assert conn.execute("PRAGMA journal_mode").fetchall() == [("delete",)]
+      indexes = conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'").fetchall()
+      assert indexes == [("idx0",)]
+    finally:
+      conn.close()
+    assert os.listdir(tmp_dir) == ['bulk.sqlite']
+
+    logger.info("Testing write() with a row with too few values in a later batch")
+    try:
+      sql.write("t", ["a", "b"], rows(100, bad=50), sqldb, batch_size=7)
+      assert False, "Expected ValueError"
+    except ValueError as e:
+      assert "Rows 49 to 55" in str(e)
+    assert sql.execute(sqldb, "SELECT COUNT(*) FROM t") == [(100,)]
+    assert os.listdir(tmp_dir) == ['bulk.sqlite']
+
+
+def _memory_tests():
+
+  # Queries of a database configured with memory=True read an in-memory
+  # copy, which is made again when the database is replaced, unless the
+  # database is larger than memory_limit.
+
+  import tempfile
+
+  import tableui
+
+  sql = tableui.sql
+
+  with tempfile.TemporaryDirectory() as tmp_dir:
+    sqldb = os.path.join(tmp_dir, 'memory.sqlite')
+    tableui.list2sql("t", [["a1"]], ["a"], out=sqldb)
+    sql.configure(sqldb, memory=True)
+    pool = sql._POOLS[os.path.abspath(sqldb)]
+
+    logger.info("Testing queries of an in-memory copy")
+    assert sql.execute(sqldb, "SELECT a FROM t") == [("a1",)]
+    memory = pool['memory']
+    assert memory is not None
+    assert sql.execute(sqldb, "PRAGMA database_list")[0][2] == memory['name']
+
+    logger.info("Testing in-memory copy after the database is replaced")
+    tableui.list2sql("t", [["a2"]], ["a"], out=sqldb)
+    assert sql.execute(sqldb, "SELECT a FROM t") == [("a2",)]
+    assert pool['memory'] is not None
+    assert pool['memory']['name'] != memory['name']
+
+    logger.info("Testing memory=True with a database larger than memory_limit")
+    sql.configure(sqldb, memory=True, memory_limit=1)
+    pool = sql._POOLS[os.path.abspath(sqldb)]
+    assert sql.execute(sqldb, "SELECT a FROM t") == [("a2",)]
+    assert pool['memory'] is None
+    assert sql.execute(sqldb, "PRAGMA database_list")[0][2] == os.path.realpath(sqldb)
+
+
+def _sqlite_options_tests():
+
+  # URI parameters and pragmas set with configure(..., sqlite=...) are used
+  # by connections for queries.
+
+  import sqlite3
+  import tempfile
+
+  import tableui
+
+  sql = tableui.sql
+
+  with tempfile.TemporaryDirectory() as tmp_dir:
+    sqldb = os.path.join(tmp_dir, 'options.sqlite')
+    tableui.list2sql("t", [["a1"]], ["a"], out=sqldb)
+
+    logger.info("Testing default options (mode=ro)")
+    sql.configure(sqldb)
+    try:
+      sql.execute(sqldb, "CREATE TABLE u (a)")
+      assert False, "Expected read-only connection"
+    except sqlite3.OperationalError as e:
+      assert "readonly" in str(e)
+
+    logger.info("Testing pragmas")
+    options = {"cache_size": -1234, "mmap_size": 1048576, "temp_store": "memory", "immutable": True}
+    sql.configure(sqldb, sqlite=options)
+    assert sql.execute(sqldb, "PRAGMA cache_size") == [(-1234,)]
+    assert sql.execute(sqldb, "PRAGMA mmap_size") == [(1048576,)]
+    # 2 = MEMORY
+    assert sql.execute(sqldb, "PRAGMA temp_store") == [(2,)]
+    assert sql.execute(sqldb, "SELECT a FROM t") == [("a1",)]
+
+    logger.info("Testing mode=rw with query_only")
+    sql.configure(sqldb, sqlite={"mode": "rw", "query_only": True})
+    assert sql.execute(sqldb, "PRAGMA query_only") == [(1,)]
+    sql.configure(sqldb, sqlite={"mode": "rw"})
+    sql.execute(sqldb, "CREATE TABLE u (a)")
+    assert "u" in sql.table_names(sqldb)
+
+    logger.info("Testing invalid options")
+    for options in [{"cache": 1}, {"mode": "rwc"}, {"immutable": "yes"}, {"temp_store": "disk"}]:
+      try:
+        sql.configure(sqldb, sqlite=options)
+        assert False, f"Expected ValueError for {options}"
+      except ValueError:
+        pass
+
+
+def _template_tests(configs, config, body_data):
+
+  # Queries of the same shape (columns searched and sorted) with different
+  # values use the same SQL text from _sql_template(), with values bound as
+  # parameters.
+
+  import importlib
+
+  import utilrsw.uvicorn
+
+  app = importlib.import_module('tableui.app')
+
+  base = f"http://127.0.0.1:{configs['server']['--port']}"
+  configs['app']['config'] = config
+
+  wait = {
+    "url": f"{base}/config",
+    "retries": 10,
+    "delay": 0.5
+  }
+  process = utilrsw.uvicorn.start('tableui.app', configs, wait=wait)
+
+  try:
+    for b in ["b01", "b02", "b03"]:
+      url = f"{base}/data/?b='{b}'&_orders=-d&_start=0&_length=5"
+      _log_test_title(url)
+      response = requests.get(url)
+      assert response.status_code == 200
+      assert response.json()['data'] == [row for row in body_data if row[1] == b]
+
+    # Values are parameters, not part of the SQL text
+    for a, n_expected in [("a1", 3), ("a'1", 0), ("a1%", 3)]:
+      url = f"{base}/data/?_start=0&_length=5"
+      _log_test_title(f"{url}&a={a}")
+      response = requests.get(url, params={"a": a})
+      assert response.status_code == 200
+      assert response.json()['recordsFiltered'] == n_expected
+  finally:
+    utilrsw.uvicorn.stop(process)
+
+  logger.info("Testing _sql_template() cache")
+  shape = {
+    "table": "demo",
+    "all_columns": ("a", "b"),
+    "returns": None,
+    "searches": (("a", "contains"),),
+    "globalsearch": None,
+    "orders": ("-b",),
+    "paging": "page"
+  }
+  hits = app._sql_template.cache_info().hits
+  template = app._sql_template(**shape)
+  assert app._sql_template(**shape) is template
+  assert app._sql_template.cache_info().hits >= hits + 1
+  assert "LIKE ? ESCAPE" in template[2]
+
+
+def _sidecar_tests(configs):
+
+  # /sqldb sends a precompressed copy of the database (e.g., demo.sqlite.gz)
+  # when the request accepts its encoding and the copy is not older than the
+  # database.
+
+  import gzip
+  import tempfile
+
+  import utilrsw.uvicorn
+
+  import tableui
+
+  base = f"http://127.0.0.1:{configs['server']['--port']}"
+
+  with tempfile.TemporaryDirectory() as tmp_dir:
+    sqldb = os.path.join(tmp_dir, 'sidecar.sqlite')
+    tableui.list2sql("demo", [["a1", "b1"]], ["a", "b"], out=sqldb)
+    with open(sqldb, 'rb') as f:
+      content = f.read()
+    with gzip.open(f"{sqldb}.gz", 'wb') as f:
+      f.write(content)
+    mtime = os.stat(sqldb).st_mtime_ns
+    os.utime(f"{sqldb}.gz", ns=(mtime + 10**9, mtime + 10**9))
+
+    configs['app']['config'] = {"table_name": "demo", "sqldb": sqldb}
+    wait = {
+      "url": f"{base}/config",
+      "retries": 10,
+      "delay": 0.5
+    }
+    process = utilrsw.uvicorn.start('tableui.app', configs, wait=wait)
+
+    try:
+      url = f"{base}/sqldb"
+
+      _log_test_title(f"{url} with Accept-Encoding: gzip")
+      response = requests.get(url, headers={"Accept-Encoding": "gzip"})
+      assert response.status_code == 200
+      assert response.headers['Content-Encoding'] == "gzip"
+      assert response.headers['Vary'] == "Accept-Encoding"
+      assert response.content == content
+
+      _log_test_title(f"{url} with Accept-Encoding: br")
+      response = requests.get(url, headers={"Accept-Encoding": "br"})
+      assert response.status_code == 200
+      assert 'Content-Encoding' not in response.headers
+      assert response.content == content
+
+      _log_test_title(f"{url} with Accept-Encoding: gzip;q=0")
+      response = requests.get(url, headers={"Accept-Encoding": "gzip;q=0"})
+      assert response.status_code == 200
+      assert 'Content-Encoding' not in response.headers
+      assert response.content == content
+
+      _log_test_title(f"{url} with Accept-Encoding: gzip and an older sidecar")
+      os.utime(f"{sqldb}.gz", ns=(mtime - 10**9, mtime - 10**9))
+      response = requests.get(url, headers={"Accept-Encoding": "gzip"})
+      assert response.status_code == 200
+      assert 'Content-Encoding' not in response.headers
+      assert response.content == content
+    finally:
+      utilrsw.uvicorn.stop(process)
+
+
+def _cache_tests(configs, config, body_data):
+
+  # Responses to /data/ from the response cache, which must have the _draw
+  # of the request, and If-None-Match requests that get 304 Not Modified.
+  # min_size = 0 so that cached responses are also sent compressed.
+
+  import tempfile
+
+  import utilrsw.uvicorn
+
+  base = f"http://127.0.0.1:{configs['server']['--port']}"
+
+  with tempfile.TemporaryDirectory() as tmp_dir:
+    app_config = {
+      "cache": True,
+      "compression": {"min_size": 0},
+      "config": config
+    }
+    app_config_file = os.path.join(tmp_dir, 'app.json')
+    with open(app_config_file, 'w') as f:
+      json.dump(app_config, f)
+    configs['app']['config'] = app_config_file
+
+    wait = {
+      "url": f"{base}/config",
+      "retries": 10,
+      "delay": 0.5
+    }
+    process = utilrsw.uvicorn.start('tableui.app', configs, wait=wait)
+
+    try:
+      url = f"{base}/data/?_start=0&_length=5"
+      n = min(5, len(body_data))
+      responses = []
+      for draw in [1, 2]:
+        _log_test_title(f"{url}&_draw={draw}")
+        response = requests.get(f"{url}&_draw={draw}", headers={"Accept-Encoding": "gzip"})
+        assert response.status_code == 200
+        assert response.headers['Content-Encoding'] == "gzip"
+        assert response.json()['draw'] == draw
+        assert response.json()['data'] == body_data[0:n]
+        responses.append(response)
+      etag = responses[0].headers['ETag']
+      assert responses[1].headers['ETag'] == etag
+
+      _log_test_title(f"{url} with If-None-Match: {etag}")
+      response = requests.get(url, headers={"If-None-Match": etag})
+      assert response.status_code == 304
+      assert response.content == b""
+      assert response.headers['ETag'] == etag
+
+      _log_test_title(f'{url} with If-None-Match: W/"other"')
+      response = requests.get(url, headers={"If-None-Match": 'W/"other"'})
+      assert response.status_code == 200
+      assert response.json()['data'] == body_data[0:n]
+    finally:
+      utilrsw.uvicorn.stop(process)
+
+
+def _replace_tests(configs, head_file, body_file):
+
+  # Requests right after the database is replaced while the server is
+  # running (before the thread that watches files re-resolves the config)
+  # must use the new number of rows and column names.
+
+  import tempfile
+
+  import tableui
+  import utilrsw.uvicorn
+
+  base = f"http://127.0.0.1:{configs['server']['--port']}"
+
+  with tempfile.TemporaryDirectory() as tmp_dir:
+    sqldb = os.path.join(tmp_dir, 'demo.sqlite')
+    tableui.list2sql("demo", body_file, head_file, out=sqldb)
+    configs['app']['config'] = {"table_name": "demo", "sqldb": sqldb}
+
+    wait = {
+      "url": f"{base}/config",
+      "retries": 10,
+      "delay": 0.5
+    }
+    process = utilrsw.uvicorn.start('tableui.app', configs, wait=wait)
+
+    try:
+      url = f"{base}/data/?_start=0&_length=5"
+      _log_test_title(url)
+      response = requests.get(url)
+      assert response.status_code == 200
+      n_rows = response.json()['recordsTotal']
+
+      head = ["a", "b", "c", "d", "e"]
+      body = [[f"a{i}", f"b{i}", f"c{i}", str(i), f"e{i}"] for i in range(n_rows + 1)]
+      tableui.list2sql("demo", body, head, out=sqldb)
+
+      _log_test_title(f"{url} after replacing {sqldb}")
+      response = requests.get(url)
+      assert response.status_code == 200
+      assert response.json()['recordsTotal'] == n_rows + 1
+      assert response.json()['data'] == body[0:5]
+
+      url = f"{base}/data/?_start=0&_length=5&_orders=-e"
+      _log_test_title(url)
+      response = requests.get(url)
+      assert response.status_code == 200
+      assert response.json()['data'][0] == max(body, key=lambda row: row[4])
+    finally:
+      utilrsw.uvicorn.stop(process)
+
+
+def _read_tests(head_file, body_file, body_data):
+
+  # Reading of body files by list2sql() when array elements span chunks of
+  # READ_SIZE characters and when the body is an .ndjson file.
+
+  import sqlite3
+  import tempfile
+  import importlib
+
+  import tableui
+
+  list2sql = importlib.import_module('tableui.list2sql')
+
+  with tempfile.TemporaryDirectory() as tmp_dir:
+    indented_file = os.path.join(tmp_dir, 'demo.body.json')
+    with open(indented_file, 'w') as f:
+      json.dump(body_data, f, indent=2)
+
+    read_size = list2sql.READ_SIZE
+    try:
+      for size in [1, 2, 7, 64]:
+        list2sql.READ_SIZE = size
+        for file in [body_file, indented_file]:
+          logger.info(f"Testing _json_rows('{file}') with READ_SIZE = {size}")
+          assert list(list2sql._json_rows(file)) == body_data
+    finally:
+      list2sql.READ_SIZE = read_size
+
+    logger.info("Testing list2sql() with an .ndjson body")
+    ndjson_file = os.path.join(tmp_dir, 'demo.body.ndjson')
+    with open(ndjson_file, 'w') as f:
+      for row in body_data:
+        f.write(json.dumps(row) + "\n\n")
+    out = tableui.list2sql("demo", ndjson_file, head_file, types={'d': 'INTEGER'})
+    assert out == os.path.join(tmp_dir, 'demo.body.sqlite')
+    conn = sqlite3.connect(out)
+    try:
+      rows = conn.execute("SELECT * FROM demo ORDER BY rowid").fetchall()
+    finally:
+      conn.close()
+    assert [list(row) for row in rows] == body_data
+
+
+def _infer_tests():
+
+  # Column types inferred by list2sql(..., infer=...), including integers
+  # that do not fit in an SQLite INTEGER.
+
+  import sqlite3
+  import tempfile
+
+  import tableui
+
+  head = ["id", "n", "x", "s", "zip"]
+  body = []
+  for i in range(10):
+    body.append([str(10**19 + i), str(i), f"{i}.5", f"s{i}", f"0{i}"])
+
+  with tempfile.TemporaryDirectory() as tmp_dir:
+    for infer in ["sample", "all"]:
+      logger.info(f"Testing list2sql(..., infer='{infer}')")
+      out = os.path.join(tmp_dir, f'{infer}.sqlite')
+      tableui.list2sql("t", body, head, out=out, infer=infer)
+      conn = sqlite3.connect(out)
+      try:
+        types = conn.execute("SELECT type FROM pragma_table_info('t')").fetchall()
+        rows = conn.execute("SELECT * FROM t ORDER BY rowid").fetchall()
+      finally:
+        conn.close()
+      assert [row[0] for row in types] == ["TEXT", "INTEGER", "REAL", "TEXT", "TEXT"]
+      assert rows[1] == (str(10**19 + 1), 1, 1.5, "s1", "01")
+
+    logger.info("Testing casting of values that do not match the column type")
+    out = os.path.join(tmp_dir, 'cast.sqlite')
+    body = [["1", "1.5", "x"], ["x", None, 2], [None, "2", "y"], [str(2**63), "3", "z"]]
+    tableui.list2sql("t", body, ["i", "r", "s"], out=out, types=["INTEGER", "REAL", "TEXT"])
+    conn = sqlite3.connect(out)
+    try:
+      rows = conn.execute("SELECT i, typeof(i), r, s FROM t ORDER BY rowid").fetchall()
+    finally:
+      conn.close()
+    assert rows[0:3] == [(1, "integer", 1.5, "x"), ("x", "text", None, "2"), (None, "null", 2.0, "y")]
+    assert rows[3][1] != "integer"
+
+
+def _write_tests(head_file, body_file):
+
+  # list2sql() with mode="append" and mode="upsert", which must also update
+  # the full-text search index, and with mode="replace" when writing fails.
+
+  import sqlite3
+  import tempfile
+
+  import tableui
+
+  table_name = "demo"
+
+  def query(file, sql, params=()):
+    conn = sqlite3.connect(file)
+    try:
+      return conn.execute(sql, params).fetchall()
+    finally:
+      conn.close()
+
+  def search(file, text):
+    sql = f"SELECT a FROM `{table_name}` WHERE rowid IN "
+    sql += f"(SELECT rowid FROM `{table_name}.fts` WHERE `{table_name}.fts` MATCH ?) "
+    sql += "ORDER BY a"
+    return [row[0] for row in query(file, sql, (f'"{text}"',))]
+
+  with tempfile.TemporaryDirectory() as tmp_dir:
+    out = os.path.join(tmp_dir, 'demo.sqlite')
+    kwargs = {'types': {'d': 'INTEGER'}, 'fts': True, 'out': out}
+    tableui.list2sql(table_name, body_file, head_file, **kwargs)
+    n_rows = query(out, f"SELECT COUNT(*) FROM `{table_name}`")[0][0]
+
+    logger.info("Testing list2sql(..., mode='append')")
+    body = [["a99", "b99", "c99", 99]]
+    tableui.list2sql(table_name, body, head_file, out=out, mode="append")
+    assert query(out, f"SELECT COUNT(*) FROM `{table_name}`")[0][0] == n_rows + 1
+    assert search(out, "b99") == ["a99"]
+
+    logger.info("Testing list2sql(..., mode='upsert', key='a')")
+    body = [["a01", "x01", "c01", 100], ["a98", "b98", "c98", 98]]
+    tableui.list2sql(table_name, body, head_file, out=out, mode="upsert", key="a")
+    assert query(out, f"SELECT COUNT(*) FROM `{table_name}`")[0][0] == n_rows + 2
+    rows = query(out, f"SELECT b, d FROM `{table_name}` WHERE a = 'a01'")
+    assert rows == [("x01", 100)]
+    assert search(out, "x01") == ["a01"]
+    assert search(out, "b01") == []
+    assert search(out, "b98") == ["a98"]
+
+    logger.info("Testing list2sql(..., mode='replace') with a row that is not a list")
+    with open(out, 'rb') as f:
+      content = f.read()
+    body = [["a01", "b01", "c01", 1], "not a row"]
+    try:
+      tableui.list2sql(table_name, body, head_file, out=out)
+      assert False, "Expected ValueError"
+    except ValueError:
+      pass
+    with open(out, 'rb') as f:
+      assert f.read() == content
+    assert os.listdir(tmp_dir) == ['demo.sqlite']
+
+
 if __name__ == "__main__":
 
   import tableui
@@ -297,3 +1174,75 @@ if __name__ == "__main__":
   config["sqldb"] = sqldb_path # Should match kwargs['out']
   configs['app']['config'] = config
   _run_tests(configs, head_data, body_data, debug=debug)
+
+  # Test 3
+  # As Test 2 but with full-text search index used for _globalsearch
+  config = {"table_name": table_name}
+  kwargs['fts'] = True
+  kwargs['out'] = 'demo/demo-fts.sqlite'
+  sqldb_path = tableui.list2sql(table_name, body_file, head_file, **kwargs)
+  config["sqldb"] = sqldb_path
+  configs['app']['config'] = config
+  _run_tests(configs, head_data, body_data, debug=debug)
+
+  # Test 4
+  # Updates of a database by list2sql()
+  _write_tests(head_file, body_file)
+
+  # Test 5
+  # Reading of body files by list2sql()
+  _read_tests(head_file, body_file, body_data)
+
+  # Test 6
+  # As Test 2 but with the response cache used
+  config = {"table_name": table_name, "sqldb": 'demo/demo.sqlite'}
+  _cache_tests(configs, config, body_data)
+
+  # Test 7
+  # Database replaced while the server is running
+  _replace_tests(configs, head_file, body_file)
+
+  # Test 8
+  # Inference of column types by list2sql()
+  _infer_tests()
+
+  # Test 9
+  # Pooled connections used by tableui.sql
+  _pool_tests()
+
+  # Test 10
+  # Cached row counts
+  _nrows_tests()
+
+  # Test 11
+  # Most frequent unique values
+  _uniques_tests()
+
+  # Test 12
+  # Requests that time out or exceed the executor's limits
+  _executor_tests(configs)
+
+  # Test 13
+  # Proposed and created indexes
+  _index_tests(configs, head_file, body_file)
+
+  # Test 14
+  # Rows written in batches
+  _bulk_tests()
+
+  # Test 15
+  # In-memory copies of databases
+  _memory_tests()
+
+  # Test 16
+  # SQLite connection options
+  _sqlite_options_tests()
+
+  # Test 17
+  # SQL for query shapes
+  config = {"table_name": table_name, "sqldb": 'demo/demo.sqlite'}
+  _template_tests(configs, config, body_data)
+
+  # Test 18
+  # Precompressed copies of the database sent by /sqldb
+  _sidecar_tests(configs)
@@ -1,6 +1,8 @@
 from setuptools import setup, find_packages
 
 install_requires = ["uvicorn", "fastapi"]
+# Optional packages used if installed
+extras_require = {"speedups": ["orjson", "brotli", "zstandard"]}
 
 setup(
     name='tableui',
@@ -12,5 +14,6 @@ setup(
     description='Serve a SQL database as a web page using DataTables.',
     long_description=open('README.md').read(),
     long_description_content_type='text/markdown',
-    install_requires=install_requires
+    install_requires=install_requires,
+    extras_require=extras_require
 )
@@ -0,0 +1,3 @@
+import tableui
+
+tableui.cli_sql()
@@ -1,4 +1,4 @@
-from tableui.cli import cli
+from tableui.cli import cli, cli_sql
 from tableui.app import app
 from tableui.list2sql import list2sql
 from tableui.dict2sql import dict2sql
@@ -1,11 +1,32 @@
 import os
 import copy
 import json
+import functools
 import urllib
 import logging
+import threading
+import collections
 
 import tableui
 
+try:
+  # Optional; faster serialization of responses
+  import orjson
+except ImportError:
+  orjson = None
+
+try:
+  # Optional; brotli (br) compression of responses
+  import brotli
+except ImportError:
+  brotli = None
+
+try:
+  # Optional; zstd compression of responses
+  import zstandard
+except ImportError:
+  zstandard = None
+
 logger = logging.getLogger(__name__)
 
 ROOT_DIR = os.path.normpath(os.path.join(os.path.dirname(__file__), ".."))
@@ -13,6 +34,99 @@ CONFIG_DEFAULT = os.path.join(ROOT_DIR, "conf", "default.json")
 RENDER_DEFAULT = os.path.join(ROOT_DIR, "js", "render.js")
 STYLE_DEFAULT = os.path.join(ROOT_DIR, "css", "index.css")
 
+# Defaults for the executor that runs /data/ requests. At most 'workers'
+# requests run at once and at most 'queue' more wait; others get a 503.
+# Queries in a request taking longer than 'timeout' seconds get a 504.
+EXECUTOR_DEFAULTS = {
+  "workers": 4,
+  "queue": 32,
+  "timeout": 30
+}
+_EXECUTOR = {
+  "settings": dict(EXECUTOR_DEFAULTS),
+  "pool": None,
+  "pending": 0,
+  "lock": threading.Lock()
+}
+
+# For _format=columnar&_dictionary=true, string columns with at most this
+# fraction of unique values are dictionary encoded.
+DICTIONARY_RATIO = 0.5
+
+# Maximum number of SQL templates (query text for a query shape) kept by
+# _sql_template()
+TEMPLATE_CACHE_SIZE = 1024
+
+# Serializes writes to query_log files
+_QUERY_LOG_LOCK = threading.Lock()
+
+# Defaults for the thread that checks every 'interval' seconds whether files
+# that a config was resolved from changed (e.g., a database was replaced).
+# If so, the config is resolved again and the first 'pages' pages of data are
+# requested in the background; requests use the previous config until then
+# unless the database changed (see _config_resolve_cached()). Set "watch": false in the app config to re-resolve on the first request
+# after a change instead.
+WATCH_DEFAULTS = {
+  "interval": 2,
+  "pages": 1
+}
+_WATCH = {
+  "settings": dict(WATCH_DEFAULTS),
+  "threads": {},
+  "lock": threading.Lock()
+}
+
+# Defaults for the cache of /data/ and compressed /jsondb responses, which
+# is used if "cache" is in the app config. Responses are removed after 'ttl'
+# seconds or when the database or config changes, and least recently used
+# responses are removed when the cache holds more than 'max_bytes'.
+CACHE_DEFAULTS = {
+  "max_bytes": 64*2**20,
+  "ttl": 300
+}
+_CACHE = {
+  "settings": None,
+  "entries": collections.OrderedDict(),
+  "bytes": 0,
+  "lock": threading.Lock()
+}
+
+# Defaults for compression of responses. Responses smaller than 'min_size'
+# bytes are not compressed. Other keys are the level used for each
+# Content-Encoding; null disables it. br and zstd require the brotli and
+# zstandard packages. Set "compression": false in the app config to disable.
+COMPRESSION_DEFAULTS = {
+  "min_size": 1024,
+  "br": 4,
+  "zstd": 3,
+  "gzip": 6
+}
+_COMPRESSION = {
+  "settings": dict(COMPRESSION_DEFAULTS),
+  "lock": threading.Lock()
+}
+# Extensions of precompressed copies of files sent by /sqldb
+SIDECAR_EXTENSIONS = {
+  "br": ".br",
+  "zstd": ".zst",
+  "gzip": ".gz"
+}
+
+# Responses of /, /config, /render.js, and /style.css keyed on (path, name).
+# Bodies and their compressed forms are computed when the config they were
+# built from is re-resolved or a file they were built from changes.
+STATIC_CACHE_CONTROL = "no-cache"
+_STATIC = {}
+_STATIC_LOCK = threading.Lock()
+
+# Resolved configs keyed on (config, path). An entry is reused until the
+# modification time or size of any file it was resolved from changes.
+_CONFIG_CACHE = {}
+_CONFIG_CACHE_LOCK = threading.Lock()
+# Files modified less than this many seconds before a config is resolved may
+# have changed during resolution (file system timestamps can lag the clock).
+CONFIG_MTIME_SLACK = 2
+
 
 def app(config):
   import fastapi
@@ -20,13 +134,18 @@ def app(config):
   if isinstance(config, str):
     # Load app configuration from JSON file
     # If config['config'] is a string, it is a file path and will be re-read
-    # for each API request that requires it.
+    # by API requests that require it when it (or a file it references)
+    # changes.
     with open(config, "r") as f:
       logger.info(f"Reading: {config}")
       config = f.read()
       config = json.loads(config)
       debug = config.get("debug", False)
       log_level = config.get("log_level", None)
+      _executor_init(config.get("executor", None))
+      _watch_init(config.get("watch", None))
+      _cache_init(config.get("cache", None))
+      _compression_init(config.get("compression", None))
       config = config['config']
       if debug:
         logger.setLevel(logging.DEBUG)
@@ -34,7 +153,7 @@ def app(config):
         logger.setLevel(log_level.upper())
       logger.info(f"Debug: {debug}, log_level: {log_level}")
 
-  fastapi_app = fastapi.FastAPI()
+  fastapi_app = fastapi.FastAPI(lifespan=_watch_lifespan(config))
   _api_init(fastapi_app, config)
 
   return fastapi_app
@@ -115,10 +234,14 @@ def _api_init(app, config, path=None, related_paths=None):
   def indexhtml(request: fastapi.Request):
     # Silently ignores any query parameters
     fname = os.path.join(ROOT_DIR, 'index.html')
-    logger.info("Reading: " + fname)
-    with open(fname) as f:
-      indexhtml_ = f.read()
-    return fastapi.responses.HTMLResponse(indexhtml_)
+
+    def build():
+      logger.info("Reading: " + fname)
+      with open(fname, 'rb') as f:
+        return f.read()
+
+    version = _config_mtimes([fname])
+    return _static_response(request, (path_o, 'index'), None, version, build, "text/html; charset=utf-8")
 
   if "jsondb" in config_r:
     endpoint = f"{path}/jsondb"
@@ -128,22 +251,15 @@ def _api_init(app, config, path=None, related_paths=None):
       # Silently ignores any query parameters other than _verbose
       query_params = dict(request.query_params)
 
-      config_r, err = _config_resolve(config, path=path_o, update=True)
+      config_r, err = _config_resolve_cached(config, path=path_o)
       if err is not None:
         content = {"error": err}
         return fastapi.responses.JSONResponse(content=content, status_code=500)
 
-      with open(config_r['jsondb']['body']) as f:
-        # TODO: Stream
-        logger.info("Reading and sending: " + config_r['jsondb']['body'])
-        data = json.load(f)
-        # TODO: Use _verbose validation in data()
-        data = _data_transform(data, config_r['column_names'], query_params.get("_verbose", None) == "true")
-      data = {
-        "columns": config_r['column_names'],
-        "data": data
-      }
-      return fastapi.responses.JSONResponse(data)
+      # TODO: Use _verbose validation in data()
+      verbose = query_params.get("_verbose", None) == "true"
+      prefix = b'{"columns":' + _json_dumps(config_r['column_names']) + b',"data":'
+      return _jsondb_response(request, config_r, prefix, b'}', verbose)
 
   if "sqldb" in config_r and config_r["sqldb"] is not None:
     endpoint = f"{path}/sqldb"
@@ -152,7 +268,7 @@ def _api_init(app, config, path=None, related_paths=None):
     def sqldb(request: fastapi.Request):
       # Silently ignores any query parameters
 
-      config_r, err = _config_resolve(config, path=path_o, update=True)
+      config_r, err = _config_resolve_cached(config, path=path_o)
       if err is not None:
         content = {"error": err}
         return fastapi.responses.JSONResponse(content=content, status_code=500)
@@ -162,7 +278,11 @@ def _api_init(app, config, path=None, related_paths=None):
                   'media_type': 'application/x-sqlite3',
                   'filename': filename
                 }
-      return fastapi.responses.FileResponse(config_r['sqldb'], **kwargs)
+      fname, encoding = _sidecar(request, config_r['sqldb'])
+      if encoding != 'identity':
+        logger.info(f"Sending {encoding} compressed copy: {fname}")
+        kwargs['headers'] = {"Content-Encoding": encoding, "Vary": "Accept-Encoding"}
+      return fastapi.responses.FileResponse(fname, **kwargs)
 
   endpoint = f"{path}/config"
   logger.info(f"Initializing endpoint '{endpoint}'")
@@ -170,7 +290,7 @@ def _api_init(app, config, path=None, related_paths=None):
   def configx(request: fastapi.Request):
     # Silently ignores any query parameters
 
-    config_r, err = _config_resolve(config, path=path_o, update=True)
+    config_r, err = _config_resolve_cached(config, path=path_o)
     if err is not None:
       content = {"error": err}
       return fastapi.responses.JSONResponse(content=content, status_code=500)
@@ -180,48 +300,62 @@ def _api_init(app, config, path=None, related_paths=None):
       content = {"error": err}
       return fastapi.responses.JSONResponse(content=content, status_code=500)
 
-    if len(related_paths) > 1:
-      config_r['dataTablesAdditions']['relatedTables'] = related_paths
+    def build():
+      # config_r is shared with other requests, so copy before adding to it
+      dataTablesAdditions = config_r['dataTablesAdditions']
+      if len(related_paths) > 1:
+        dataTablesAdditions = {**dataTablesAdditions, 'relatedTables': related_paths}
 
-    content = {
-      "dataTables": config_r['dataTables'],
-      "dataTablesAdditions": config_r['dataTablesAdditions']
-    }
+      content = {
+        "dataTables": config_r['dataTables'],
+        "dataTablesAdditions": dataTablesAdditions
+      }
+      return _json_dumps(content)
 
-    return fastapi.responses.JSONResponse(content=content)
+    return _static_response(request, (path_o, 'config'), config_r, related_paths, build, "application/json")
 
   endpoint = f"{path}/style.css"
   logger.info(f"Initializing endpoint '{endpoint}'")
   @app.route(f"{path}/style.css", methods=["GET", "HEAD"])
   def style(request: fastapi.Request):
     # Silently ignores any query parameters
-    config_r, err = _config_resolve(config, path=path_o, update=True)
+    config_r, err = _config_resolve_cached(config, path=path_o)
     if err is not None:
       content = {"error": err}
       return fastapi.responses.JSONResponse(content=content, status_code=500)
 
-    content = _read_default('style', config_r)
+    def build():
+      return _read_default('style', config_r).encode('utf-8')
 
-    return fastapi.responses.Response(content=content, media_type="text/css")
+    version = _config_mtimes([STYLE_DEFAULT])
+    return _static_response(request, (path_o, 'style'), config_r, version, build, "text/css; charset=utf-8")
 
   endpoint = f"{path}/render.js"
   logger.info(f"Initializing endpoint '{endpoint}'")
   @app.route(f"{path}/render.js", methods=["GET", "HEAD"])
   def render(request: fastapi.Request):
     # Silently ignores any query parameters
-    config_r, err = _config_resolve(config, path=path_o, update=True)
+    config_r, err = _config_resolve_cached(config, path=path_o)
     if err is not None:
       content = {"error": err}
       return fastapi.responses.JSONResponse(content=content, status_code=500)
 
-    media_type = "application/javascript"
-    content = _read_default('renderFunctions', config_r)
-    return fastapi.responses.Response(content=content, media_type=media_type)
+    def build():
+      return _read_default('renderFunctions', config_r).encode('utf-8')
+
+    media_type = "application/javascript; charset=utf-8"
+    version = _config_mtimes([RENDER_DEFAULT])
+    return _static_response(request, (path_o, 'render'), config_r, version, build, media_type)
 
   endpoint = f"{path}/data/"
   logger.info(f"Initializing endpoint '{endpoint}'")
   @app.route(f"{path}/data/", methods=["POST", "GET", "HEAD"])
-  def data(request: fastapi.Request):
+  async def data(request: fastapi.Request):
+    # Database queries are run by an executor separate from the one used by
+    # other endpoints so that slow queries do not delay them.
+    return await _executor_run(data_, request)
+
+  def data_(request):
 
     logger.info(f"Data request with query params: {request.query_params}")
     query_params = dict(request.query_params)
@@ -238,7 +372,7 @@ def _api_init(app, config, path=None, related_paths=None):
     else:
       query_params["_verbose"] = False
 
-    config_r, err = _config_resolve(config, path=path_o, update=True)
+    config_r, err = _config_resolve_cached(config, path=path_o)
     if err is not None:
       content = {"error": err}
       return fastapi.responses.JSONResponse(content=content, status_code=500)
@@ -252,10 +386,16 @@ def _api_init(app, config, path=None, related_paths=None):
           content = {"error": emsg}
           return fastapi.responses.JSONResponse(content=content, status_code=400)
 
-      data = config_r['jsondb']['data']
-      column_names = config_r['column_names']
-      data = _data_transform(data, column_names, query_params["_verbose"])
-      return fastapi.responses.JSONResponse({"data": data})
+      return _jsondb_response(request, config_r, b'{"data":', b'}', query_params["_verbose"])
+
+    cache_key = _cache_key(config_r, path_o, request)
+    entry = _cache_get(cache_key, config_r)
+    if entry is not None:
+      # Only responses to valid requests are cached, but _draw may differ
+      draw, err = parse_int("_draw", query_params, min=1, default=1)
+      if err is None:
+        logger.info("Using cached response")
+        return _data_response(request, entry, draw)
 
     # sqldb and server-side processing
     keys_allowed = [
@@ -267,7 +407,11 @@ def _api_init(app, config, path=None, related_paths=None):
       '_return',
       '_uniques',
       '_globalsearch',
-      '_verbose'
+      '_verbose',
+      '_keyset',
+      '_cursor',
+      '_format',
+      '_dictionary'
     ]
     # We ignore the DataTables jQuery cache-buster "_"
 
@@ -293,9 +437,40 @@ def _api_init(app, config, path=None, related_paths=None):
     else:
       query_params["_uniques"] = False
 
+    query_params["_format"] = query_params.get("_format", "rows")
+    if query_params["_format"] not in ["rows", "columnar"]:
+      emsg = "Error: _format must be 'rows' or 'columnar'"
+      content = {"error": emsg}
+      return fastapi.responses.JSONResponse(content=content, status_code=400)
+    if query_params["_format"] == "columnar" and query_params["_verbose"]:
+      emsg = "Error: _verbose=true cannot be used with _format=columnar"
+      content = {"error": emsg}
+      return fastapi.responses.JSONResponse(content=content, status_code=400)
+
+    if "_dictionary" in query_params:
+      if query_params["_dictionary"] not in ["true", "false"]:
+        emsg = "Error: _dictionary must be 'true' or 'false'"
+        content = {"error": emsg}
+        return fastapi.responses.JSONResponse(content=content, status_code=400)
+      query_params["_dictionary"] = query_params["_dictionary"] == "true"
+    else:
+      query_params["_dictionary"] = False
+
+    if "_keyset" in query_params:
+      if query_params["_keyset"] not in ["true", "false"]:
+        emsg = "Error: _keyset must be 'true' or 'false'"
+        content = {"error": emsg}
+        return fastapi.responses.JSONResponse(content=content, status_code=400)
+      query_params["_keyset"] = query_params["_keyset"] == "true"
+    else:
+      query_params["_keyset"] = False
+
     query_params["_start"], err = parse_int("_start", query_params, min=0, default=0)
     if err is not None:
       return err
+    if query_params.get("_length", None) == "-1":
+      # DataTables uses -1 for "All" in lengthMenu
+      del query_params["_length"]
     query_params["_length"], err = parse_int("_length", query_params, min=1, default=None)
     if err is not None:
       return err
@@ -315,6 +490,17 @@ def _api_init(app, config, path=None, related_paths=None):
     else:
       query_params["_orders"] = None
 
+    if "_cursor" in query_params:
+      # A cursor implies _keyset=true and takes precedence over _start
+      cursor, emsg = _keyset_decode(query_params["_cursor"], query_params["_orders"])
+      if emsg is not None:
+        content = {"error": f"Error: {emsg}"}
+        return fastapi.responses.JSONResponse(content=content, status_code=400)
+      query_params["_cursor"] = cursor
+      query_params["_keyset"] = True
+    else:
+      query_params["_cursor"] = None
+
     if "_globalsearch" in query_params:
       kwargs = {'encoding': 'utf-8', 'errors': 'replace'}
       query_params["_globalsearch"] = urllib.parse.unquote(query_params["_globalsearch"], **kwargs)
@@ -346,36 +532,259 @@ def _api_init(app, config, path=None, related_paths=None):
     else:
       query_params["_return"] = None
 
+    draw, err = parse_int("_draw", query_params, min=1, default=1)
+    if err is not None:
+      return err
+
+    if config_r.get('query_log', None) is not None:
+      _query_log(config_r, query_params)
+
+    timeout = config_r.get('query_timeout', _EXECUTOR['settings']['timeout'])
     try:
-      result = _sql_query(config_r, query_params)
+      with tableui.sql.timeout(timeout):
+        result = _sql_query(config_r, query_params)
+    except TimeoutError as e:
+      logger.error(f"Query timed out after {timeout} [s]: {e}")
+      emsg = f"Error querying database: Query took longer than {timeout} seconds."
+      content = {"error": emsg}
+      return fastapi.responses.JSONResponse(content=content, status_code=504)
     except Exception as e:
       emsg = f"Error querying database: {e}"
       content = {"error": emsg}
       return fastapi.responses.JSONResponse(content=content, status_code=500)
 
     if query_params['_uniques']:
-      length = query_params['_length']
-      if length:
-        for col in result['data'].keys():
-          # Sort by the second element (count) in each (value, count) tuple
-          result['data'][col] = sorted(result['data'][col], key=lambda x: -x[1])
-          result['data'][col] = result['data'][col][0:length]
-      return fastapi.responses.JSONResponse(content=result['data'])
+      entry = _cache_put(cache_key, config_r, _json_dumps(result['data']), draw=False)
+      return _data_response(request, entry, draw)
 
-    data = _data_transform(result['data'], return_cols, query_params["_verbose"])
+    columnar = query_params["_format"] == "columnar"
 
-    draw, err = parse_int("_draw", query_params, min=1, default=1)
-    if err is not None:
-      return err
+    if 'batches' in result:
+      if not columnar:
+        return _data_stream(request, result, draw, return_cols, query_params["_verbose"])
+      # Columns can only be formed from all rows
+      result['data'] = [row for batch in result['batches'] for row in batch]
+      if result['recordsFiltered'] is None:
+        result['recordsFiltered'] = len(result['data'])
+
+    if columnar:
+      data = _data_columnar(result['data'], return_cols, query_params["_dictionary"])
+    else:
+      data = _data_transform(result['data'], return_cols, query_params["_verbose"])
 
+    # draw is added last by _data_response() so the content can be cached
     content = {
-                "draw": draw,
                 "recordsTotal": result['recordsTotal'],
                 "recordsFiltered": result['recordsFiltered'],
                 "data": data
               }
 
-    return fastapi.responses.JSONResponse(content=content)
+    if 'cursors' in result:
+      content['start'] = result['start']
+      content['cursors'] = result['cursors']
+
+    entry = _cache_put(cache_key, config_r, _json_dumps(content), draw=True)
+    return _data_response(request, entry, draw)
+
+
+def _cache_init(settings):
+  if settings is None or settings is False:
+    return
+  if settings is True:
+    settings = {}
+  for key in settings:
+    if key not in CACHE_DEFAULTS:
+      logger.error(f"Unknown key '{key}' in cache config. Allowed: {list(CACHE_DEFAULTS.keys())}. Exiting.")
+      exit(1)
+  with _CACHE['lock']:
+    _CACHE['settings'] = {**CACHE_DEFAULTS, **settings}
+  logger.info(f"Cache settings: {_CACHE['settings']}")
+
+
+def _cache_key(config_r, path, request):
+  # Key for the response to a /data/ request. The DataTables cache-buster
+  # "_" and _draw do not change the response content. None if the
+  # response is not cached.
+  if _CACHE['settings'] is None or config_r.get('sqldb', None) is None:
+    return None
+  try:
+    stat = os.stat(config_r['sqldb'])
+  except OSError:
+    return None
+  params = dict(request.query_params)
+  params.pop("_", None)
+  params.pop("_draw", None)
+  return (path, stat.st_ino, stat.st_mtime_ns, stat.st_size, tuple(sorted(params.items())))
+
+
+def _cache_get(key, config_r):
+  import time
+
+  if key is None:
+    return None
+  with _CACHE['lock']:
+    entry = _CACHE['entries'].get(key, None)
+    if entry is None:
+      return None
+    if entry['config'] is not config_r or entry['expires'] < time.monotonic():
+      # Config changed or entry too old
+      del _CACHE['entries'][key]
+      _CACHE['bytes'] -= entry['size']
+      return None
+    _CACHE['entries'].move_to_end(key)
+    return entry
+
+
+def _cache_put(key, config_r, content, draw):
+  # Returns the entry for content, which is stored if key is not None.
+  # content is a JSON object. If draw=True, draw is added to it as the last
+  # key so that compressed forms of all but the end of content, which are
+  # added to the entry by _data_response(), can be reused.
+  import hashlib
+
+  entry = {
+    'content': content,
+    'draw': draw,
+    'etag': f'"{hashlib.blake2b(content, digest_size=16).hexdigest()}"',
+    'config': config_r,
+    'expires': None,
+    # Compressed forms from _encode_head() keyed on encoding
+    'heads': {},
+    'size': len(content)
+  }
+
+  _cache_store(key, entry)
+  return entry
+
+
+def _cache_store(key, entry):
+  # Store entry, which has keys 'config', 'expires', and 'size', if the cache
+  # is used and key is not None.
+  import time
+
+  settings = _CACHE['settings']
+  if key is None or settings is None or entry['size'] > settings['max_bytes']:
+    return
+
+  entry['expires'] = time.monotonic() + settings['ttl']
+  with _CACHE['lock']:
+    entries = _CACHE['entries']
+    if key in entries:
+      _CACHE['bytes'] -= entries.pop(key)['size']
+    entries[key] = entry
+    _CACHE['bytes'] += entry['size']
+    _cache_evict(settings)
+
+
+def _cache_evict(settings):
+  # Remove least recently used entries until at most max_bytes are used.
+  # Call with _CACHE['lock'] held.
+  entries = _CACHE['entries']
+  while _CACHE['bytes'] > settings['max_bytes'] and entries:
+    _, evicted = entries.popitem(last=False)
+    _CACHE['bytes'] -= evicted['size']
+
+
+def _data_response(request, entry, draw):
+  # The ETag is weak because the content depends on draw. Clients that
+  # send If-None-Match with it get a 304 if the content is unchanged.
+  import fastapi
+
+  headers = {
+    "ETag": f"W/{entry['etag']}",
+    "Cache-Control": "no-cache",
+    "Vary": "Accept-Encoding"
+  }
+  if _not_modified(request, entry['etag'], None):
+    return fastapi.responses.Response(status_code=304, headers=headers)
+
+  tail = b'}'
+  if entry['draw']:
+    tail = b',"draw":' + str(draw).encode() + b'}'
+
+  encoding = _encoding(request, len(entry['content']))
+  if encoding == 'identity':
+    content = entry['content'][0:-1] + tail
+  else:
+    headers["Content-Encoding"] = encoding
+    head = entry['heads'].get(encoding, None)
+    if head is None:
+      # Compressed once per entry and encoding
+      head = _encode_head(entry['content'][0:-1], encoding)
+      _cache_add(entry, encoding, head)
+    content = _encode_tail(head, tail, encoding)
+  return fastapi.responses.Response(content=content, media_type="application/json", headers=headers)
+
+
+def _cache_add(entry, encoding, head):
+  # Add compressed form head to entry, which may be in the cache
+  settings = _CACHE['settings']
+  with _CACHE['lock']:
+    if encoding in entry['heads']:
+      return
+    entry['heads'][encoding] = head
+    entry['size'] += len(head['body'])
+    if entry['expires'] is not None and settings is not None:
+      _CACHE['bytes'] += len(head['body'])
+      _cache_evict(settings)
+
+
+def _compression_init(settings):
+  if settings is None:
+    return
+  if settings is False:
+    with _COMPRESSION['lock']:
+      _COMPRESSION['settings'] = None
+    logger.info("Compression disabled")
+    return
+  for key in settings:
+    if key not in COMPRESSION_DEFAULTS:
+      logger.error(f"Unknown key '{key}' in compression config. Allowed: {list(COMPRESSION_DEFAULTS.keys())}. Exiting.")
+      exit(1)
+  with _COMPRESSION['lock']:
+    _COMPRESSION['settings'] = {**COMPRESSION_DEFAULTS, **settings}
+  logger.info(f"Compression settings: {_COMPRESSION['settings']}")
+
+
+def _executor_init(settings):
+  if settings is None:
+    return
+  for key in settings:
+    if key not in EXECUTOR_DEFAULTS:
+      logger.error(f"Unknown key '{key}' in executor config. Allowed: {list(EXECUTOR_DEFAULTS.keys())}. Exiting.")
+      exit(1)
+  with _EXECUTOR['lock']:
+    _EXECUTOR['settings'] = {**EXECUTOR_DEFAULTS, **settings}
+  logger.info(f"Executor settings: {_EXECUTOR['settings']}")
+
+
+async def _executor_run(func, request):
+  import asyncio
+  import concurrent.futures
+  import fastapi
+
+  settings = _EXECUTOR['settings']
+  with _EXECUTOR['lock']:
+    if _EXECUTOR['pool'] is None:
+      kwargs = {'max_workers': settings['workers'], 'thread_name_prefix': 'tableui-db'}
+      _EXECUTOR['pool'] = concurrent.futures.ThreadPoolExecutor(**kwargs)
+    admit = _EXECUTOR['pending'] < settings['workers'] + settings['queue']
+    if admit:
+      _EXECUTOR['pending'] += 1
+    pending = _EXECUTOR['pending']
+
+  if not admit:
+    logger.error(f"Rejecting request; {pending} requests running or queued.")
+    content = {"error": "Server busy. Try again later."}
+    headers = {"Retry-After": "1"}
+    return fastapi.responses.JSONResponse(content=content, status_code=503, headers=headers)
+
+  try:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_EXECUTOR['pool'], func, request)
+  finally:
+    with _EXECUTOR['lock']:
+      _EXECUTOR['pending'] -= 1
 
 
 def _paths(configs, update=False):
@@ -400,7 +809,10 @@ def _paths(configs, update=False):
 def _related_paths(config, path_list, update=False):
   related_paths = []
   for path in path_list:
-    config_r, eobj = _config_resolve(config, path=path)
+    if update:
+      config_r, eobj = _config_resolve_cached(config, path=path)
+    else:
+      config_r, eobj = _config_resolve(config, path=path)
     if eobj is not None:
       return None, eobj
     # Server restart required to update related_paths
@@ -426,6 +838,248 @@ def _config_read(config_file, update=False):
       return None, _error(emsg, e, update)
 
 
+def _config_resolve_cached(config, path=None):
+  # Same as _config_resolve(config, path=path, update=True), but the result
+  # is shared between requests and must not be modified by the caller.
+
+  key = (_config_key(config), path)
+
+  with _CONFIG_CACHE_LOCK:
+    entry = _CONFIG_CACHE.get(key, None)
+
+  if entry is not None and _watching(config) and not _config_sqldb_changed(entry):
+    # Watcher thread replaces entry after other files change. A changed
+    # database is used by tableui.sql at once, so config (e.g., column names
+    # and number of rows) must be resolved again before it is queried.
+    return entry['config'], None
+
+  if entry is not None and _config_mtimes(entry['files']) == entry['mtimes']:
+    return entry['config'], None
+
+  if entry is not None:
+    logger.info(f"Config for path '{path}' or a file it references changed. Re-resolving.")
+
+  return _config_resolve_entry(config, path)
+
+
+def _config_sqldb_changed(entry):
+  # True if the database (or its WAL file) that entry was resolved from
+  # changed
+  sqldb = entry['config'].get('sqldb', None)
+  if sqldb is None:
+    return False
+  for file, mtime in zip(entry['files'], entry['mtimes']):
+    if file in (sqldb, f"{sqldb}-wal") and _config_mtimes([file])[0] != mtime:
+      return True
+  return False
+
+
+def _config_resolve_entry(config, path, warm=False):
+  # Resolve config and put it in _CONFIG_CACHE. If warm=True, data requests
+  # are made so that caches are filled before other requests use config.
+
+  import time
+
+  with _CONFIG_CACHE_LOCK:
+    entry = _CONFIG_CACHE.get((_config_key(config), path), None)
+
+  # mtimes are read before resolving so that a file changed during resolution
+  # does not match its stored mtime and config is resolved again. Files not
+  # known before resolving get the mtime read after it unless they may have
+  # changed after resolution started (None, so they never match).
+  start = time.time_ns() - CONFIG_MTIME_SLACK*10**9
+  files = [] if entry is None else entry['files']
+  before = dict(zip(files, _config_mtimes(files)))
+
+  config_r, eobj = _config_resolve(config, path=path, update=True)
+  if eobj is not None:
+    return None, eobj
+
+  files = _config_files(config, config_r)
+  mtimes = []
+  for file, mtime in zip(files, _config_mtimes(files)):
+    if file in before:
+      mtime = before[file]
+    elif mtime is not None and mtime[0] >= start:
+      mtime = None
+    mtimes.append(mtime)
+
+  if warm and config_r.get('sqldb', None) is not None:
+    _config_warm(config_r)
+
+  entry = {
+    'config': config_r,
+    'files': files,
+    'mtimes': mtimes
+  }
+  with _CONFIG_CACHE_LOCK:
+    _CONFIG_CACHE[(_config_key(config), path)] = entry
+
+  return config_r, None
+
+
+def _config_key(config):
+  return config if isinstance(config, str) else id(config)
+
+
+def _config_warm(config_r):
+  # Make the requests for the first pages that the browser makes on load.
+  # Fills the row count cache and pools and reads pages into OS file cache.
+  length = config_r['dataTables'].get('pageLength', 25)
+  for page in range(_WATCH['settings']['pages']):
+    query_params = {
+      '_start': page*length,
+      '_length': length,
+      '_orders': None,
+      'searches': {},
+      '_globalsearch': None,
+      '_return': None,
+      '_uniques': False
+    }
+    try:
+      _sql_query(config_r, query_params)
+    except Exception as e:
+      logger.warning(f"Warm-up query for {config_r['sqldb']} failed: {e}")
+      return
+
+
+def _watch_init(settings):
+  if settings is None:
+    return
+  if settings is False:
+    settings = {"interval": None}
+  for key in settings:
+    if key not in WATCH_DEFAULTS:
+      logger.error(f"Unknown key '{key}' in watch config. Allowed: {list(WATCH_DEFAULTS.keys())}. Exiting.")
+      exit(1)
+  with _WATCH['lock']:
+    _WATCH['settings'] = {**WATCH_DEFAULTS, **settings}
+  logger.info(f"Watch settings: {_WATCH['settings']}")
+
+
+def _watch_lifespan(config):
+  import contextlib
+
+  @contextlib.asynccontextmanager
+  async def lifespan(app):
+    stop = _watch_start(config)
+    try:
+      yield
+    finally:
+      if stop is not None:
+        stop.set()
+
+  return lifespan
+
+
+def _watching(config):
+  thread = _WATCH['threads'].get(_config_key(config), None)
+  return thread is not None and thread.is_alive()
+
+
+def _watch_start(config):
+  interval = _WATCH['settings']['interval']
+  if not interval:
+    return None
+
+  stop = threading.Event()
+  kwargs = {
+    'target': _watch,
+    'args': (config, interval, stop),
+    'name': 'tableui-watch',
+    'daemon': True
+  }
+  thread = threading.Thread(**kwargs)
+  with _WATCH['lock']:
+    _WATCH['threads'][_config_key(config)] = thread
+  thread.start()
+  logger.info(f"Checking for changed files every {interval} [s]")
+
+  return stop
+
+
+def _watch(config, interval, stop):
+  # Resolves and warms configs for all paths at start and then again when
+  # files they were resolved from change and have not changed for interval.
+
+  path_list, eobj = _paths(config, update=True)
+  if eobj is not None or len(path_list) == 0:
+    path_list = [""]
+
+  for path in path_list:
+    if stop.is_set():
+      return
+    try:
+      _config_resolve_entry(config, path, warm=True)
+    except Exception as e:
+      logger.error(f"Could not resolve config for path '{path}': {e}")
+
+  # Last modification times seen for each path
+  seen = {}
+  while not stop.wait(interval):
+    for path in path_list:
+      with _CONFIG_CACHE_LOCK:
+        entry = _CONFIG_CACHE.get((_config_key(config), path), None)
+      if entry is None:
+        continue
+      mtimes = _config_mtimes(entry['files'])
+      if mtimes == entry['mtimes']:
+        continue
+      if seen.get(path, None) != mtimes:
+        # Changed since last check; files may still be being written
+        seen[path] = mtimes
+        continue
+
+      logger.info(f"Files for path '{path}' changed. Re-resolving config and warming caches.")
+      try:
+        _, eobj = _config_resolve_entry(config, path, warm=True)
+      except Exception as e:
+        eobj = str(e)
+      if eobj is not None:
+        # Keep using the previous config until files change again
+        logger.error(f"Not using new config for path '{path}': {eobj}")
+        with _CONFIG_CACHE_LOCK:
+          entry['mtimes'] = mtimes
+      seen.pop(path, None)
+
+
+def _config_files(config, config_r):
+  # Files that config_r was resolved from
+
+  files = []
+  if isinstance(config, str):
+    files.append(config)
+
+  files.append(config_r.get('config_file', None))
+  files.append(config_r.get('table_meta_file', None))
+
+  if config_r.get('sqldb', None) is not None:
+    files.append(config_r['sqldb'])
+    # Writes to a database in WAL mode may not change the mtime of sqldb
+    files.append(f"{config_r['sqldb']}-wal")
+
+  if isinstance(config_r.get('jsondb', None), dict):
+    files.append(config_r['jsondb'].get('body', None))
+    files.append(config_r['jsondb'].get('head', None))
+
+  dataTablesAdditions = config_r.get('dataTablesAdditions', {})
+  files.append(dataTablesAdditions.get('renderFunctions', None))
+  files.append(dataTablesAdditions.get('style', None))
+
+  return [file for file in files if isinstance(file, str)]
+
+
+def _config_mtimes(files):
+  mtimes = []
+  for file in files:
+    try:
+      stat = os.stat(file)
+      mtimes.append((stat.st_mtime_ns, stat.st_size))
+    except OSError:
+      mtimes.append(None)
+  return mtimes
+
+
 def _config_resolve(config, path=None, update=False):
 
   if isinstance(config, str):
@@ -521,6 +1175,11 @@ def _config_resolve(config, path=None, update=False):
     return config, None
 
 
+  # Options for connections opened by tableui.sql
+  eobj = _sql_configure(config, update=update)
+  if eobj is not None:
+    return None, eobj
+
   # Adds 'sqldb_tables' to config
   eobj = _sql_table_names(config, update=update)
   if eobj is not None:
@@ -553,6 +1212,11 @@ def _config_resolve(config, path=None, update=False):
   if eobj is not None:
     return None, eobj
 
+  # Adds 'fts_columns' to config
+  eobj = _sql_fts(config, update=update)
+  if eobj is not None:
+    return None, eobj
+
   # Adds 'n_rows' to config
   eobj = _sql_n_rows(config, update=update)
   if eobj is not None:
@@ -615,6 +1279,11 @@ def _dir_resolve(config, update=False):
     if eobj is not None:
       return eobj
 
+  if config.get('query_log', None) is not None:
+    # Need not exist
+    query_log = os.path.expanduser(config['query_log'])
+    config['query_log'] = os.path.normpath(os.path.join(base_dir, query_log))
+
   if 'dataTablesAdditions' in config:
     if 'renderFunctions' in config['dataTablesAdditions']:
       path = config['dataTablesAdditions']['renderFunctions']
@@ -742,6 +1411,379 @@ def _data_transform(data, column_names, verbose):
   return data_verbose
 
 
+def _data_stream(request, result, draw, column_names, verbose):
+  # Response with the same content as the non-streamed /data/ response,
+  # but with recordsFiltered after data so it can be counted if needed.
+  import fastapi
+
+  def content():
+    head = {"draw": draw, "recordsTotal": result['recordsTotal']}
+    yield _json_dumps(head)[0:-1] + b',"data":['
+    n_rows = 0
+    for batch in result['batches']:
+      if n_rows > 0:
+        yield b","
+      n_rows += len(batch)
+      batch = _data_transform(batch, column_names, verbose)
+      yield b",".join([_json_dumps(row) for row in batch])
+    recordsFiltered = result['recordsFiltered']
+    if recordsFiltered is None:
+      recordsFiltered = n_rows
+    yield b'],"recordsFiltered":' + _json_dumps(recordsFiltered) + b'}'
+    logger.info(f"Streamed {n_rows} records")
+
+  headers = {"Vary": "Accept-Encoding"}
+  body = content()
+  encoding = _encoding(request)
+  if encoding != 'identity':
+    headers["Content-Encoding"] = encoding
+    body = _encode_stream(body, encoding)
+  return fastapi.responses.StreamingResponse(body, media_type="application/json", headers=headers)
+
+
+def _jsondb_response(request, config_r, prefix, suffix, verbose):
+  # Response with content prefix + data + suffix, where data is the jsondb
+  # body. If not verbose, the bytes of the body file are sent as-is.
+  # Supports conditional requests using ETag and Last-Modified.
+  import hashlib
+  import email.utils
+  import fastapi
+
+  fname = config_r['jsondb']['body']
+  f = open(fname, 'rb')
+  try:
+    stat = os.fstat(f.fileno())
+    variant = hashlib.sha1(prefix + suffix + str(verbose).encode()).hexdigest()[0:8]
+    encoding = _encoding(request, len(prefix) + stat.st_size + len(suffix))
+    if encoding != 'identity':
+      variant += f"-{encoding}"
+    headers = {
+      "ETag": f'"{stat.st_mtime_ns:x}-{stat.st_size:x}-{variant}"',
+      "Last-Modified": email.utils.formatdate(stat.st_mtime, usegmt=True),
+      "Vary": "Accept-Encoding"
+    }
+    if _not_modified(request, headers["ETag"], stat.st_mtime):
+      f.close()
+      return fastapi.responses.Response(status_code=304, headers=headers)
+
+    # Compressed responses are kept in the response cache, if it is used,
+    # so the file is compressed once. Keys of /data/ responses have five
+    # elements.
+    key = (fname, variant, stat.st_mtime_ns, stat.st_size)
+    if encoding != 'identity':
+      headers["Content-Encoding"] = encoding
+      entry = _cache_get(key, config_r)
+      if entry is not None:
+        f.close()
+        return fastapi.responses.Response(content=entry['content'], media_type="application/json", headers=headers)
+
+    if verbose:
+      f.close()
+      data = config_r['jsondb']['data']
+      data = _data_transform(data, config_r['column_names'], verbose)
+      content = prefix + _json_dumps(data) + suffix
+      if encoding != 'identity':
+        content = _encode(content, encoding)
+        _cache_store(key, {'content': content, 'config': config_r, 'size': len(content)})
+      return fastapi.responses.Response(content=content, media_type="application/json", headers=headers)
+  except BaseException:
+    f.close()
+    raise
+
+  def content():
+    logger.info("Sending: " + fname)
+    with f:
+      yield prefix
+      while True:
+        chunk = f.read(1024*1024)
+        if not chunk:
+          break
+        yield chunk
+      yield suffix
+
+  def content_encoded():
+    # Kept if the whole response is sent and fits in the cache
+    settings = _CACHE['settings']
+    chunks = None if settings is None else []
+    size = 0
+    for chunk in _encode_stream(content(), encoding):
+      if chunks is not None:
+        chunks.append(chunk)
+        size += len(chunk)
+        if size > settings['max_bytes']:
+          chunks = None
+      yield chunk
+    if chunks is not None:
+      _cache_store(key, {'content': b"".join(chunks), 'config': config_r, 'size': size})
+
+  if encoding == 'identity':
+    headers["Content-Length"] = str(len(prefix) + stat.st_size + len(suffix))
+    body = content()
+  else:
+    body = content_encoded()
+  return fastapi.responses.StreamingResponse(body, media_type="application/json", headers=headers)
+
+
+def _static_response(request, key, config_r, version, build, media_type):
+  # Response with content build() that is computed again only if config_r
+  # is not the config the content was built from or version (e.g., mtimes
+  # of files read by build()) changed.
+  import hashlib
+  import fastapi
+
+  with _STATIC_LOCK:
+    entry = _STATIC.get(key, None)
+  if entry is None or entry['config'] is not config_r or entry['version'] != version:
+    content = build()
+    entry = {
+      'config': config_r,
+      'version': version,
+      'etag': hashlib.blake2b(content, digest_size=16).hexdigest(),
+      'bodies': {'identity': content, **_compressed(content)}
+    }
+    with _STATIC_LOCK:
+      _STATIC[key] = entry
+
+  encoding = _accept_encoding(request, entry['bodies'])
+  etag = f'"{entry["etag"]}"' if encoding == 'identity' else f'"{entry["etag"]}-{encoding}"'
+  headers = {
+    "ETag": etag,
+    "Cache-Control": STATIC_CACHE_CONTROL,
+    "Vary": "Accept-Encoding"
+  }
+  if _not_modified(request, etag, None):
+    return fastapi.responses.Response(status_code=304, headers=headers)
+
+  if encoding != 'identity':
+    headers["Content-Encoding"] = encoding
+  content = entry['bodies'][encoding]
+  return fastapi.responses.Response(content=content, media_type=media_type, headers=headers)
+
+
+def _compressed(content):
+  # Compressed forms of content keyed on Content-Encoding. Highest levels
+  # are used because they are computed once. Forms that are not smaller
+  # than content are omitted.
+  levels = {"br": 11, "zstd": 19, "gzip": 9}
+
+  settings = _COMPRESSION['settings']
+  if settings is None or len(content) < settings['min_size']:
+    return {}
+  bodies = {encoding: _encode(content, encoding, levels[encoding]) for encoding in _encodings()}
+  return {encoding: body for encoding, body in bodies.items() if len(body) < len(content)}
+
+
+def _encodings():
+  # Content-Encodings that are enabled and available, in order of preference
+  settings = _COMPRESSION['settings']
+  if settings is None:
+    return []
+  available = {"br": brotli is not None, "zstd": zstandard is not None, "gzip": True}
+  return [encoding for encoding in available if available[encoding] and settings[encoding] is not None]
+
+
+def _encoding(request, size=None):
+  # Content-Encoding for a response to request with size bytes (None if
+  # not known, e.g., for a stream) or 'identity' if it is not compressed.
+  settings = _COMPRESSION['settings']
+  if settings is None:
+    return 'identity'
+  if size is not None and size < settings['min_size']:
+    return 'identity'
+  return _accept_encoding(request, _encodings())
+
+
+def _compressor(encoding, level):
+  # (compress, flush) functions. Output of compress(chunk) for each chunk
+  # followed by flush() is the compressed stream.
+  import zlib
+
+  if encoding == 'gzip':
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress, compressor.flush
+  if encoding == 'br':
+    compressor = brotli.Compressor(quality=level)
+    return compressor.process, compressor.finish
+  if encoding == 'zstd':
+    compressor = zstandard.ZstdCompressor(level=level).compressobj()
+    return compressor.compress, compressor.flush
+  raise ValueError(f"Unknown encoding '{encoding}'")
+
+
+def _encode_head(content, encoding):
+  # Compressed form of content that _encode_tail() completes with more
+  # bytes without compressing content again.
+  import zlib
+
+  level = _COMPRESSION['settings'][encoding]
+  if encoding == 'gzip':
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    body = compressor.compress(content) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    # Header with no file name and mtime = 0 (RFC 1952)
+    body = b'\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\xff' + body
+    return {'body': body, 'crc': zlib.crc32(content), 'size': len(content)}
+  if encoding == 'br':
+    compressor = brotli.Compressor(quality=level)
+    # flush() ends the output at a byte boundary
+    return {'body': compressor.process(content) + compressor.flush()}
+  if encoding == 'zstd':
+    compressor = zstandard.ZstdCompressor(level=level).compressobj()
+    return {'body': compressor.compress(content) + compressor.flush()}
+  raise ValueError(f"Unknown encoding '{encoding}'")
+
+
+def _encode_tail(head, tail, encoding):
+  # Compressed form of content + tail, where head = _encode_head(content)
+  import zlib
+  import struct
+
+  level = _COMPRESSION['settings'][encoding]
+  if encoding == 'gzip':
+    # Final deflate block(s), then CRC-32 and size of all uncompressed data
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    body = compressor.compress(tail) + compressor.flush()
+    crc = zlib.crc32(tail, head['crc'])
+    size = (head['size'] + len(tail)) & 0xffffffff
+    return head['body'] + body + struct.pack("<II", crc, size)
+  if encoding == 'br':
+    # Uncompressed meta-block with tail and an empty last meta-block
+    # (RFC 7932 Section 9.2). MLEN - 1 is in 16 bits, so len(tail) <= 65536.
+    header = ((len(tail) - 1) << 3 | 1 << 19).to_bytes(3, 'little')
+    return head['body'] + header + tail + b'\x03'
+  if encoding == 'zstd':
+    # A zstd stream may have more than one frame
+    compressor = zstandard.ZstdCompressor(level=level).compressobj()
+    return head['body'] + compressor.compress(tail) + compressor.flush()
+  raise ValueError(f"Unknown encoding '{encoding}'")
+
+
+def _encode(content, encoding, level=None):
+  if level is None:
+    level = _COMPRESSION['settings'][encoding]
+  compress, flush = _compressor(encoding, level)
+  return compress(content) + flush()
+
+
+def _encode_stream(chunks, encoding):
+  # Compress a stream without waiting for all of it
+  compress, flush = _compressor(encoding, _COMPRESSION['settings'][encoding])
+  for chunk in chunks:
+    chunk = compress(chunk)
+    if chunk:
+      yield chunk
+  yield flush()
+
+
+def _sidecar(request, file):
+  # Precompressed copy of file (e.g., file.gz) to send instead of file if
+  # request accepts its encoding and it is not older than file. Returns
+  # (file to send, encoding).
+  if _COMPRESSION['settings'] is None:
+    return file, 'identity'
+
+  mtime = os.stat(file).st_mtime_ns
+  sidecars = {}
+  for encoding, extension in SIDECAR_EXTENSIONS.items():
+    try:
+      if os.stat(file + extension).st_mtime_ns >= mtime:
+        sidecars[encoding] = file + extension
+    except OSError:
+      continue
+
+  encoding = _accept_encoding(request, sidecars)
+  return sidecars.get(encoding, file), encoding
+
+
+def _accept_encoding(request, encodings):
+  # Encoding in encodings with the highest q value in the Accept-Encoding
+  # header of request (br, then zstd, then gzip for equal values) or
+  # 'identity'.
+  header = request.headers.get("accept-encoding", None)
+  if not header:
+    return 'identity'
+
+  qs = {}
+  for part in header.split(","):
+    name, _, params = part.strip().partition(";")
+    q = 1.0
+    params = params.strip()
+    if params.startswith("q="):
+      try:
+        q = float(params[2:])
+      except ValueError:
+        q = 0.0
+    qs[name.strip().lower()] = q
+
+  best, best_q = 'identity', 0.0
+  for encoding in ['br', 'zstd', 'gzip']:
+    q = qs.get(encoding, qs.get("*", 0.0))
+    if encoding in encodings and q > best_q:
+      best, best_q = encoding, q
+  return best
+
+
+def _not_modified(request, etag, mtime):
+  # True if request has If-None-Match with etag or, if no If-None-Match,
+  # If-Modified-Since not before mtime (RFC 9110 Section 13.1). mtime=None
+  # means If-Modified-Since is ignored.
+  import email.utils
+
+  if_none_match = request.headers.get("if-none-match", None)
+  if if_none_match is not None:
+    etags = [tag.strip() for tag in if_none_match.split(",")]
+    etags = [tag[2:] if tag.startswith("W/") else tag for tag in etags]
+    return "*" in etags or etag in etags
+
+  if_modified_since = request.headers.get("if-modified-since", None)
+  if if_modified_since is not None and mtime is not None:
+    try:
+      since = email.utils.parsedate_to_datetime(if_modified_since)
+    except (TypeError, ValueError):
+      return False
+    return int(mtime) <= since.timestamp()
+
+  return False
+
+
+def _data_columnar(data, column_names, dictionary):
+  # Dict with a list of values for each column. If dictionary=True, string
+  # columns with few unique values are given as {"dictionary": unique
+  # values, "indices": index in unique values for each row}.
+
+  columns = list(zip(*data)) if len(data) > 0 else [()]*len(column_names)
+  data_columnar = {}
+  for column_name, values in zip(column_names, columns):
+    if dictionary and _dictionary_encodable(values):
+      index = {}
+      indices = [index.setdefault(value, len(index)) for value in values]
+      data_columnar[column_name] = {"dictionary": list(index), "indices": indices}
+    else:
+      data_columnar[column_name] = values
+  return data_columnar
+
+
+def _dictionary_encodable(values):
+  if len(values) == 0:
+    return False
+  if not all(isinstance(value, str) or value is None for value in values):
+    return False
+  return len(set(values)) <= DICTIONARY_RATIO*len(values)
+
+
+def _json_dumps(content):
+  # Same serialization as fastapi.responses.JSONResponse, but with orjson
+  # if it is installed.
+  if orjson is not None:
+    return orjson.dumps(content)
+  kwargs = {
+    "ensure_ascii": False,
+    "allow_nan": False,
+    "indent": None,
+    "separators": (",", ":")
+  }
+  return json.dumps(content, **kwargs).encode("utf-8")
+
+
 def _column_names(config, update=False):
 
   def set_config_columns(column_names):
@@ -829,6 +1871,7 @@ def _table_meta(config, update=False):
         logger.warning("No table_meta file given.")
   else:
     if isinstance(config['table_meta'], str) and os.path.exists(config['table_meta']):
+      config['table_meta_file'] = config['table_meta']
       with open(config['table_meta']) as f:
         try:
           config['table_meta'] = json.load(f)
@@ -841,61 +1884,22 @@ def _table_meta(config, update=False):
 
 def _sql_query(dbinfo, query_params):
 
-  def orderby(orders):
-    if orders is None:
-      return ""
-    orderstr = "ORDER BY "
-    for order in orders:
-      if order.startswith("-"):
-        orderstr += f"`{order[1:]}` DESC, "
-      else:
-        orderstr += f"`{order}` ASC, "
-    orderstr = orderstr[:-2]
-    return orderstr
-
-  def where(searches, globalsearch=None, all_columns=None):
-    if searches is None:
-        return "", []
-    keys = list(searches.keys())
-    clauses = []
-    params = []
-    escape = "\\"
-    for key in keys:
-      val = searches[key]
-      if val == "''" or val == '""':
-        clauses.append(f"`{key}` = ?")
-        params.append('')
-      elif val.startswith('>'):
-        clauses.append(f"`{key}` > ?")
-        params.append(val[1:])
-      elif val.startswith('≥'):
-        clauses.append(f"`{key}` >= ?")
-        params.append(val[1:])
-      elif val.startswith('<'):
-        clauses.append(f"`{key}` < ?")
-        params.append(val[1:])
-      elif val.startswith('≤'):
-        clauses.append(f"`{key}` <= ?")
-        params.append(val[1:])
-      elif val.startswith("'") and val.endswith("'"):
-        clauses.append(f"`{key}` = ?")
-        params.append(val.strip("'"))
-      elif val.startswith('%') and not val.endswith('%'):
-        clauses.append(f"`{key}` LIKE ? ESCAPE '{escape}'")
-        params.append(val)
-      elif not val.startswith('%') and val.endswith('%'):
-        clauses.append(f"`{key}` LIKE ? ESCAPE '{escape}'")
-        params.append(val)
-      else:
-        clauses.append(f"`{key}` LIKE ? ESCAPE '{escape}'")
-        params.append(f"%{val}%")
-    if globalsearch and all_columns:
-      or_parts = [f"`{col}` LIKE ? ESCAPE '{escape}'" for col in all_columns]
-      clauses.append("(" + " OR ".join(or_parts) + ")")
-      params.extend([f"%{globalsearch}%"] * len(all_columns))
-    if len(clauses) == 0:
-      return "", []
-    return "WHERE " + " AND ".join(clauses), params
+  def fts(globalsearch, all_columns):
+    # Use full-text search index if it gives the same result as LIKE. The
+    # trigram tokenizer only matches terms with three or more characters.
+    fts_columns = dbinfo.get('fts_columns', None)
+    if fts_columns is None or not set(all_columns) <= set(fts_columns):
+      return False
+    if len(globalsearch) < 3:
+      return False
+    # LIKE wildcards and escape character
+    if any(c in globalsearch for c in ['%', '_', '\\']):
+      return False
+    # LIKE ignores case of ASCII letters only; the trigram tokenizer also
+    # ignores case of other letters (e.g., "é" matches "É").
+    if not globalsearch.isascii():
+      return False
+    return True
 
   offset = query_params['_start']
   limit = query_params['_length']
@@ -904,6 +1908,8 @@ def _sql_query(dbinfo, query_params):
   globalsearch = query_params.get('_globalsearch', None)
   _return = query_params['_return']
   uniques = query_params['_uniques']
+  keyset = query_params.get('_keyset', False)
+  cursor = query_params.get('_cursor', None)
 
   recordsTotal = dbinfo['n_rows']
   recordsFiltered = recordsTotal
@@ -911,41 +1917,71 @@ def _sql_query(dbinfo, query_params):
   sqldb = dbinfo['sqldb']
   table = dbinfo['table_name']
 
-  clause, params = where(searches, globalsearch=globalsearch, all_columns=dbinfo['column_names'])
+  # Only values are parameters; the query text depends only on the shape of
+  # the query and is reused from _sql_template().
+  all_columns = tuple(dbinfo['column_names'])
+  shape = {
+    'table': table,
+    'all_columns': all_columns,
+    'returns': None if _return is None else tuple(_return),
+    'searches': (),
+    'globalsearch': None,
+    'orders': None if orders is None else tuple(orders)
+  }
+  params = []
+  if searches is not None:
+    ops = []
+    for key, val in searches.items():
+      op, param = _search_op(val)
+      ops.append((key, op))
+      params.append(param)
+    shape['searches'] = tuple(ops)
+    if globalsearch and all_columns:
+      if fts(globalsearch, all_columns):
+        shape['globalsearch'] = 'fts'
+        params.append('"' + globalsearch.replace('"', '""') + '"')
+      else:
+        shape['globalsearch'] = 'like'
+        params.extend([f"%{globalsearch}%"] * len(all_columns))
+
+  columns_str, clause, query = _sql_template(**shape, paging=None)
+  logger.debug(f"Cache of SQL templates: {_sql_template.cache_info()}")
 
   if uniques:
-    uniques = {}
     columns = _return
     if _return is None:
       columns = dbinfo['column_names']
-    for col in columns:
-      logger.info(f"Getting unique values for column '{col}'")
-      uniques[col] = tableui.sql.uniques(sqldb, table, col, clause=clause, params=params)
-      logger.info(f"Got {len(uniques[col])} unique values\n")
-      # Each value is a list of (value, count) tuples
+    # If limit is given, only the limit most frequent values are returned
+    logger.info(f"Getting unique values for columns {columns}")
+    uniques = tableui.sql.uniques(sqldb, table, columns, clause=clause, params=params, limit=limit)
+    logger.info(f"Got {sum(len(vals) for vals in uniques.values())} unique values\n")
+    # Each value is a list of (value, count) tuples
     return {"data": uniques}
 
-  if _return is None:
-    columns_str = "*"
-  else:
-    columns_str = ", ".join([f"`{col}`" for col in _return])
-
-  query = f"SELECT {columns_str} FROM `{table}` {clause} {orderby(orders)}"
-  if offset == 0 and limit is None:
-    logger.info("No _start or _length given. Extracting all records.")
-    data = tableui.sql.execute(sqldb, query, params=params)
-    if searches is not None:
-      recordsFiltered = len(data)
+  if limit is None and cursor is None:
+    # Records are streamed in batches so that memory use does not depend on
+    # the number of records.
+    if offset == 0:
+      logger.info("No _start or _length given. Streaming all records.")
+      # Counted as records are streamed
+      recordsFiltered = None
+    else:
+      logger.info(f"No _length given. Streaming all records starting at _start={offset}.")
+      if clause:
+        recordsFiltered = tableui.sql.nrows(sqldb, table, clause=clause, params=params)
+      query = _sql_template(**shape, paging='offset')[2]
+      params = [*params, offset]
     return {
               'recordsTotal': recordsTotal,
               'recordsFiltered': recordsFiltered,
-              'data': data
+              'batches': tableui.sql.iterate(sqldb, query, params=params)
             }
 
-  if searches is not None:
+  if clause:
     logger.info("Getting number of filtered records")
     recordsFiltered = tableui.sql.nrows(sqldb, table, clause=clause, params=params)
     logger.info(f"Got number of filtered records = {recordsFiltered}\n")
+    logger.debug(f"Cache of number of filtered records: {tableui.sql.nrows_cache_info()}")
 
   if limit is None:
     limit = recordsTotal
@@ -969,17 +2005,28 @@ def _sql_query(dbinfo, query_params):
 
   warning = " ".join(warnings) if warnings else None
 
-  query = f"{query} LIMIT {limit} OFFSET {offset}"
-  logger.info(query)
-  logger.info(f"Getting records with offset={offset} and limit={limit}")
-  data = tableui.sql.execute(sqldb, query, params=params)
-  logger.info(f"Got {len(data)} records\n")
-
-  result = {
-              'recordsTotal': recordsTotal,
-              'recordsFiltered': recordsFiltered,
-              'data': data
-            }
+  if keyset:
+    result = _sql_keyset(dbinfo, columns_str, clause, params, orders, offset, limit, cursor)
+    result['recordsTotal'] = recordsTotal
+    result['recordsFiltered'] = recordsFiltered
+    next_ = result['cursors']['next']
+    if next_ is not None and next_['s'] >= recordsFiltered:
+      result['cursors']['next'] = None
+    for key in ['next', 'prev']:
+      if result['cursors'][key] is not None:
+        result['cursors'][key] = _keyset_encode(result['cursors'][key])
+  else:
+    query = _sql_template(**shape, paging='page')[2]
+    logger.info(query)
+    logger.info(f"Getting records with offset={offset} and limit={limit}")
+    data = tableui.sql.execute(sqldb, query, params=[*params, limit, offset])
+    logger.info(f"Got {len(data)} records\n")
+
+    result = {
+                'recordsTotal': recordsTotal,
+                'recordsFiltered': recordsFiltered,
+                'data': data
+              }
 
   if warning is not None:
     result['warning'] = warning
@@ -987,6 +2034,240 @@ def _sql_query(dbinfo, query_params):
   return result
 
 
+@functools.lru_cache(maxsize=TEMPLATE_CACHE_SIZE)
+def _sql_template(table, all_columns, returns, searches, globalsearch, orders, paging):
+  # SQL for a query shape. Values are bound as parameters, so queries with
+  # the same shape use the same text and SQLite reuses the statement it
+  # prepared for it (see tableui.sql.CACHED_STATEMENTS).
+  #   returns: tuple of columns or None for all columns
+  #   searches: tuple of (column, operator from _search_op())
+  #   globalsearch: None, 'fts', or 'like' (any of all_columns)
+  #   orders: tuple of columns, with "-" prefix for descending, or None
+  #   paging: None, 'offset' (LIMIT -1 OFFSET ?), or 'page' (LIMIT ? OFFSET ?)
+  # Returns (columns_str, clause, query).
+
+  escape = "\\"
+  clauses = []
+  for key, op in searches:
+    if op in ['prefix', 'suffix', 'contains']:
+      clauses.append(f"`{key}` LIKE ? ESCAPE '{escape}'")
+    else:
+      clauses.append(f"`{key}` {op} ?")
+  if globalsearch == 'fts':
+    table_fts = f"{table}.fts"
+    clauses.append(f"rowid IN (SELECT rowid FROM `{table_fts}` WHERE `{table_fts}` MATCH ?)")
+  elif globalsearch == 'like':
+    or_parts = [f"`{col}` LIKE ? ESCAPE '{escape}'" for col in all_columns]
+    clauses.append("(" + " OR ".join(or_parts) + ")")
+  clause = "WHERE " + " AND ".join(clauses) if clauses else ""
+
+  orderstr = ""
+  if orders:
+    orderstr = "ORDER BY " + ", ".join(
+      f"`{order[1:]}` DESC" if order.startswith("-") else f"`{order}` ASC"
+      for order in orders
+    )
+
+  if returns is None:
+    columns_str = "*"
+  else:
+    columns_str = ", ".join([f"`{col}`" for col in returns])
+
+  query = f"SELECT {columns_str} FROM `{table}` {clause} {orderstr}"
+  if paging == 'offset':
+    query = f"{query} LIMIT -1 OFFSET ?"
+  elif paging == 'page':
+    query = f"{query} LIMIT ? OFFSET ?"
+
+  return columns_str, clause, query
+
+
+def _query_log(config_r, query_params):
+  # Append the form of the query (not the search values) to the query_log
+  # file. Used by tableui.sql.advise() to propose indexes.
+  shape = {
+    "table": config_r['table_name'],
+    "orders": query_params['_orders'] or [],
+    "searches": {key: _search_op(val)[0] for key, val in query_params['searches'].items()},
+    "globalsearch": query_params['_globalsearch'] is not None,
+    "uniques": None
+  }
+  if query_params['_uniques']:
+    shape['uniques'] = query_params['_return'] or config_r['column_names']
+
+  try:
+    with _QUERY_LOG_LOCK:
+      with open(config_r['query_log'], 'a') as f:
+        f.write(json.dumps(shape) + "\n")
+  except Exception as e:
+    logger.error(f"Could not write to query_log file {config_r['query_log']}: {e}")
+
+
+def _search_op(val):
+  # Operator and parameter for the search value val of a column. Operators
+  # prefix, suffix, and contains are LIKE with the parameter as pattern.
+  if val == "''" or val == '""':
+    return '=', ''
+  if val.startswith('>'):
+    return '>', val[1:]
+  if val.startswith('≥'):
+    return '>=', val[1:]
+  if val.startswith('<'):
+    return '<', val[1:]
+  if val.startswith('≤'):
+    return '<=', val[1:]
+  if val.startswith("'") and val.endswith("'"):
+    return '=', val.strip("'")
+  if val.startswith('%') and not val.endswith('%'):
+    return 'suffix', val
+  if not val.startswith('%') and val.endswith('%'):
+    return 'prefix', val
+  return 'contains', f"%{val}%"
+
+
+def _sql_keyset(dbinfo, columns_str, clause, params, orders, offset, limit, cursor):
+  # Keyset (seek) paging. Rows are ordered by the _orders columns followed by
+  # rowid so that each row has a unique key. A cursor holds the key of the
+  # last (or first) row of a page and the next (or previous) page is found
+  # by seeking to that key instead of skipping rows with OFFSET. Without a
+  # cursor, OFFSET is used so that _start can jump to any page.
+
+  terms = []
+  for order in orders or []:
+    if order.startswith("-"):
+      terms.append((f"`{order[1:]}`", True))
+    else:
+      terms.append((f"`{order}`", False))
+  # rowid breaks ties. Sorting it in the same direction as the last column
+  # allows an index on the _orders columns to give the order.
+  terms.append(("rowid", terms[-1][1] if terms else False))
+
+  reverse = cursor is not None and cursor['d'] == 'prev'
+
+  orderstr = []
+  for col, desc in terms:
+    orderstr.append(f"{col} {'ASC' if desc == reverse else 'DESC'}")
+  orderstr = "ORDER BY " + ", ".join(orderstr)
+
+  # Key columns are appended to the returned columns and removed below
+  keystr = ", ".join([col for col, _ in terms])
+  query = f"SELECT {columns_str}, {keystr} FROM `{dbinfo['table_name']}`"
+  if cursor is None:
+    query = f"{query} {clause} {orderstr} LIMIT ? OFFSET ?"
+    params = [*params, limit, offset]
+    start = offset
+  else:
+    nulls = True
+    col, desc = terms[0]
+    if desc != reverse and cursor['k'][0] is not None:
+      # Rows with NULL sort after the cursor, which prevents bounding the
+      # first column by the cursor value unless the column has no NULLs.
+      query_nulls = f"SELECT EXISTS (SELECT 1 FROM `{dbinfo['table_name']}` WHERE {col} IS NULL)"
+      nulls = tableui.sql.execute(dbinfo['sqldb'], query_nulls)[0][0] == 1
+    seek, seek_params = _keyset_seek(terms, cursor['k'], reverse, nulls=nulls)
+    clause = f"{clause} AND {seek}" if clause else f"WHERE {seek}"
+    query = f"{query} {clause} {orderstr} LIMIT ?"
+    params = [*params, *seek_params, limit]
+    start = cursor['s']
+
+  logger.info(f"Getting records with keyset paging; start={start} and limit={limit}")
+  rows = tableui.sql.execute(dbinfo['sqldb'], query, params=params)
+  logger.info(f"Got {len(rows)} records\n")
+  if reverse:
+    rows.reverse()
+
+  n_keys = len(terms)
+  data = [row[0:-n_keys] for row in rows]
+
+  cursors = {'next': None, 'prev': None}
+  orders = orders or []
+  if len(rows) > 0:
+    key = list(rows[-1][-n_keys:])
+    cursors['next'] = {'o': orders, 'k': key, 'd': 'next', 's': start + len(rows)}
+    if start > 0:
+      key = list(rows[0][-n_keys:])
+      cursors['prev'] = {'o': orders, 'k': key, 'd': 'prev', 's': max(0, start - limit)}
+
+  return {'data': data, 'start': start, 'cursors': cursors}
+
+
+def _keyset_seek(terms, key, reverse, nulls=True):
+  # WHERE condition for rows after key in the order given by terms (before
+  # key if reverse). As in SQLite, NULLs are smaller than any other value.
+  # nulls=False means the first column is known to have no NULLs.
+
+  def after(col, desc, val):
+    if desc == reverse:
+      # Ascending
+      if val is None:
+        return f"{col} IS NOT NULL", []
+      return f"{col} > ?", [val]
+    if val is None:
+      return None, []
+    return f"({col} < ? OR {col} IS NULL)", [val]
+
+  ors = []
+  params = []
+  for i, (col, desc) in enumerate(terms):
+    cond, cond_params = after(col, desc, key[i])
+    if cond is None:
+      continue
+    ands = []
+    for (col_eq, _), val in zip(terms[0:i], key[0:i]):
+      if val is None:
+        ands.append(f"{col_eq} IS NULL")
+      else:
+        ands.append(f"{col_eq} = ?")
+        params.append(val)
+    ands.append(cond)
+    params.extend(cond_params)
+    ors.append(" AND ".join(ands))
+
+  if len(ors) == 0:
+    return "0", []
+
+  seek = " OR ".join([f"({cond})" for cond in ors])
+  col, desc = terms[0]
+  if key[0] is None:
+    return f"({seek})", params
+
+  # Redundant bound on the first column so that an index on it can be used
+  # to seek to the first row instead of evaluating the OR for every row.
+  if desc == reverse:
+    bound = f"{col} >= ?"
+  elif nulls:
+    bound = f"({col} <= ? OR {col} IS NULL)"
+  else:
+    bound = f"{col} <= ?"
+  return f"{bound} AND ({seek})", [key[0], *params]
+
+
+def _keyset_encode(cursor):
+  import base64
+  token = json.dumps(cursor, separators=(',', ':')).encode('utf-8')
+  return base64.urlsafe_b64encode(token).decode('ascii').rstrip('=')
+
+
+def _keyset_decode(token, orders):
+  import base64
+  try:
+    token = token + "=" * (-len(token) % 4)
+    cursor = json.loads(base64.urlsafe_b64decode(token.encode('ascii')))
+    assert isinstance(cursor, dict)
+    assert isinstance(cursor['o'], list)
+    assert isinstance(cursor['k'], list)
+    assert len(cursor['k']) == len(cursor['o']) + 1
+    assert cursor['d'] in ['next', 'prev']
+    assert isinstance(cursor['s'], int) and cursor['s'] >= 0
+  except Exception:
+    return None, "_cursor is not a valid cursor"
+
+  if cursor['o'] != (orders or []):
+    return None, "_cursor was created with different _orders"
+
+  return cursor, None
+
+
 def _sql_table_meta(config, update=False):
 
   table_metadata = f"{config['table_name']}.metadata"
@@ -1015,6 +2296,22 @@ def _sql_table_meta(config, update=False):
   return None
 
 
+def _sql_fts(config, update=False):
+  # Full-text search index created by tableui.sql.create_fts()
+  config['fts_columns'] = None
+  table_fts = f"{config['table_name']}.fts"
+  if table_fts in config['sqldb_tables']:
+    try:
+      logger.info("Getting columns of full-text search index")
+      config['fts_columns'] = tableui.sql.column_names(config['sqldb'], table_fts)
+      logger.info(f"Got {len(config['fts_columns'])} columns\n")
+    except Exception as e:
+      emsg = f"Error getting columns of full-text search index {table_fts}"
+      return _error(emsg, e, update)
+
+  return None
+
+
 def _sql_n_rows(config, update=False):
   try:
     logger.info("Getting number of rows")
@@ -1027,6 +2324,23 @@ def _sql_n_rows(config, update=False):
   return None
 
 
+def _sql_configure(config, update=False):
+  try:
+    kwargs = {
+      'pool_size': config.get('pool_size', None),
+      'streams': config.get('streams', None),
+      'memory': config.get('memory', False),
+      'memory_limit': config.get('memory_limit', None),
+      'sqlite': config.get('sqlite', None)
+    }
+    tableui.sql.configure(config['sqldb'], **kwargs)
+  except Exception as e:
+    emsg = f"Error configuring connections to {config['sqldb']}"
+    return _error(emsg, e, update)
+
+  return None
+
+
 def _sql_table_names(config, update=False):
   try:
     logger.info("Getting table names")
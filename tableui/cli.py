@@ -55,3 +55,80 @@ def cli():
   configs = utilrsw.uvicorn.cli(parser=parser)
 
   return configs
+
+
+def cli_sql(args=None):
+  import json
+  import argparse
+  import logging
+
+  import tableui
+
+  description = """
+  Maintenance commands for SQLite databases served by tableui.
+  --------------------
+  Example usage:
+    python sqldb.py fts demo/demo.sqlite demo
+    python sqldb.py fts demo/demo.sqlite demo --columns a,b
+    python sqldb.py index demo/demo.sqlite demo --columns b,c
+    python sqldb.py index demo/demo.sqlite demo --columns b --collate NOCASE
+    python sqldb.py advise demo/demo.sqlite demo demo/queries.log
+    python sqldb.py advise demo/demo.sqlite demo demo/queries.log --build
+  """
+
+  parser_kwargs = {
+    "description": description,
+    "formatter_class": argparse.RawDescriptionHelpFormatter
+  }
+
+  parser = argparse.ArgumentParser(**parser_kwargs)
+  subparsers = parser.add_subparsers(dest="command", required=True)
+
+  fts_help = "Create (or re-create) the full-text search index used for _globalsearch."
+  parser_fts = subparsers.add_parser("fts", help=fts_help)
+  parser_fts.add_argument("file", help="SQLite database file.")
+  parser_fts.add_argument("table", help="Table name.")
+  parser_fts.add_argument("--columns", default=None, help="Comma-separated list of columns to index. Default: all.")
+
+  index_help = "Create an index (composite if more than one column)."
+  parser_index = subparsers.add_parser("index", help=index_help)
+  parser_index.add_argument("file", help="SQLite database file.")
+  parser_index.add_argument("table", help="Table name.")
+  parser_index.add_argument("--columns", required=True, help="Comma-separated list of columns to index, or * for one index per column.")
+  parser_index.add_argument("--include", default=None, help="Comma-separated list of columns to add to make a covering index.")
+  parser_index.add_argument("--collate", default=None, help="Collation for indexed columns, e.g., NOCASE.")
+
+  advise_help = "Propose indexes based on a log of queries (see 'query_log' config option)."
+  parser_advise = subparsers.add_parser("advise", help=advise_help)
+  parser_advise.add_argument("file", help="SQLite database file.")
+  parser_advise.add_argument("table", help="Table name.")
+  parser_advise.add_argument("query_log", help="File written by server.")
+  parser_advise.add_argument("--max", type=int, default=5, help="Maximum number of indexes to propose.")
+  parser_advise.add_argument("--build", action="store_true", default=False, help="Create the proposed indexes.")
+
+  args = parser.parse_args(args)
+
+  logging.getLogger('tableui.sql').setLevel(logging.INFO)
+
+  if args.command == "fts":
+    columns = None
+    if args.columns is not None:
+      columns = args.columns.split(",")
+    tableui.sql.create_fts(args.file, args.table, columns=columns)
+
+  if args.command == "index":
+    index = {"columns": args.columns if args.columns == "*" else args.columns.split(",")}
+    if args.include is not None:
+      index["include"] = args.include.split(",")
+    if args.collate is not None:
+      index["collate"] = args.collate
+    tableui.sql.create_indexes(args.file, args.table, [index])
+
+  if args.command == "advise":
+    proposed = tableui.sql.advise(args.file, args.table, args.query_log, max_indexes=args.max)
+    if len(proposed) == 0:
+      print("No indexes proposed.")
+    for spec, count in proposed:
+      print(f"{json.dumps(spec)}  # used by {count} logged queries")
+    if args.build and len(proposed) > 0:
+      tableui.sql.create_indexes(args.file, args.table, [spec for spec, _ in proposed])
@@ -2,6 +2,17 @@ import utilrsw
 
 logger = None
 
+# Default number of datasets processed at a time by a worker process when
+# config['workers'] > 1
+CHUNK_SIZE = 1000
+
+# Files written by default. Use config['outputs'] to write a subset.
+OUTPUTS = ['meta', 'header', 'body', 'csv', 'sql', 'counts']
+
+# Inputs shared by the chunks processed in a worker process; set by
+# _chunk_init()
+_chunk = None
+
 def dict2sql(datasets, config, embed=False, logger=None):
 
   if logger is None:
@@ -18,15 +29,26 @@ def dict2sql(datasets, config, embed=False, logger=None):
     attributes[path] = config['paths'][path]
 
   attribute_counts = None
-  if config.get('use_all_attributes', False):
+  use_all_attributes = config.get('use_all_attributes', False)
+  if use_all_attributes:
     # Modify attributes dict to include all unique attributes found in all
     # variables. If an attribute is misspelled, it is mapped to the correct
     # spelling and placed in the attributes dict if there is a fix for it
-    # name config.json. The return value of attributes_all is a list 
-    # of all uncorrected attribute names encountered.
+    # name config.json. attributes_all is a list of all uncorrected
+    # attribute names encountered.
+    logger.info("Finding all unique attributes and creating table rows")
+  else:
+    logger.info("Creating table rows")
+
+  workers = config.get('workers', None)
+  if workers is not None and workers > 1:
+    walk = _table_walk_parallel
+  else:
+    walk = _table_walk
+  attributes_all, table = walk(datasets, attributes, config, collect=use_all_attributes)
+
+  if use_all_attributes:
     import collections
-    logger.info("Finding all unique attributes")
-    attributes_all = _table_walk(datasets, attributes, config, mode='attributes')
     attribute_counts = collections.Counter(attributes_all)
     attribute_counts = sorted(attribute_counts.items(), key=lambda i: i[0].lower())
 
@@ -42,19 +64,16 @@ def dict2sql(datasets, config, embed=False, logger=None):
   # Create table header based on attributes dict.
   header = _table_header(attributes)
 
-  logger.info("Creating table rows")
-  table = _table_walk(datasets, attributes, config, mode='rows')
-  s = "" if len(table) == 1 else "s"
-  logger.info(f"Created {len(table)} table row{s}")
-
-  if len(table) > 0 and len(header) != len(table[0]):
-    emsg = f"len(header) == {len(header)} != len(table[0]) = {len(table[0])}"
-    raise Exception(emsg)
-
-  if len(table) == 0:
-    raise Exception(f"No rows in {name} table")
+  if isinstance(table, list):
+    body = table
+    _table_check(name, header, table)
+  else:
+    # Rows are created by worker processes while earlier rows are written.
+    rows = table
+    table = []
+    body = _table_rows(name, header, rows, table)
 
-  info = _write_files(name, config, out_dir, header, table, attribute_counts)
+  info = _write_files(name, config, out_dir, header, body, attribute_counts)
 
   if embed:
     # Return header, table, in place of file paths.
@@ -68,6 +87,31 @@ def dict2sql(datasets, config, embed=False, logger=None):
   return info
 
 
+def _table_check(name, header, table):
+
+  s = "" if len(table) == 1 else "s"
+  logger.info(f"Created {len(table)} table row{s}")
+
+  if len(table) > 0 and len(header) != len(table[0]):
+    emsg = f"len(header) == {len(header)} != len(table[0]) = {len(table[0])}"
+    raise Exception(emsg)
+
+  if len(table) == 0:
+    raise Exception(f"No rows in {name} table")
+
+
+def _table_rows(name, header, rows, table):
+  # Yield rows and append them to table. Checks in _table_check() are
+  # done on the first row and after the last row.
+  for row in rows:
+    if len(table) == 0 and len(header) != len(row):
+      emsg = f"len(header) == {len(header)} != len(table[0]) = {len(row)}"
+      raise Exception(emsg)
+    table.append(row)
+    yield row
+  _table_check(name, header, table)
+
+
 def _table_header(attributes):
 
   header = []
@@ -78,91 +122,248 @@ def _table_header(attributes):
   return header
 
 
-def _table_walk(datasets, attributes, config, mode='attributes'):
+def _table_walk(datasets, attributes, config, collect=False):
   """
-  If mode='attributes', returns a dictionary of attributes found across all
-  datasets and paths starting with the given attributes. If the attribute
-  is misspelled, it is mapped to the correct spelling.
-
-  If mode='rows', returns a list of rows for the table. Each row contains the
-  value of the associated attribute (accounting for misspellings) in the given
-  attributes dictionary. If the path does not have the attribute, an empty
-  string is used for the associated column.
+  Returns (attribute_names, table) after one pass over datasets. The
+  datasets are not modified.
+
+  If collect=True, attribute_names is a list of the attribute names found
+  across all datasets and paths and the attributes dictionary is updated to
+  include them. If the attribute is misspelled, it is mapped to the correct
+  spelling. If collect=False, attribute_names is None.
+
+  table is a list of rows. Each row contains the value of the associated
+  attribute (accounting for misspellings) in the attributes dictionary. If
+  the path does not have the attribute, an empty string is used for the
+  associated column. If the dataset does not have the path, '?' is used for
+  all of the path's columns.
   """
-  import copy
-
-  assert mode in ['attributes', 'rows']
 
   omit_attributes = config.get('omit_attributes', None)
+  fixes = _table_fixes(config)
 
-  fixes = None
-  if 'fix_attributes' in config:
-    if config['fix_attributes']:
-      if 'fixes' in config:
-        if mode == 'attributes':
-          logger.info("Using fixes found in config")
-        fixes = config['fixes']
-      else:
-        msg = "Error: 'fix_attributes' = True, but 'fixes' in config."
-        logger.error(msg)
+  attribute_names = [] if collect else None
 
-  if mode == 'attributes':
-    attribute_names = []
-  else:
-    table = []
+  # Split paths once instead of for every dataset
+  paths = [(path, path.split('/')) for path in attributes.keys()]
+
+  # For each dataset, the (fixed) data at each path. Rows are created
+  # after all datasets are seen because attributes found in later datasets
+  # add columns to earlier rows.
+  records = []
+  for idx, dataset in enumerate(datasets):
+    logger.debug(f"  Reading paths for element {idx}")
+    record = []
+    for path, parts in paths:
+      data = utilrsw.get_path(dataset, parts)
+      if data is not None and collect:
+        _add_attributes(data, attributes[path], attribute_names, fixes, path, omit_attributes)
+      record.append(data)
+    records.append(_fix_record(record, fixes))
+
+  columns = [(path, list(attributes[path])) for path, _ in paths]
+
+  table = []
+  for record in records:
     row = []
+    for (path, path_attributes), data in zip(columns, record):
+      if data is None:
+        msg = f"    No path '{path}'. Using '?' for all attrib. vals."
+        logger.warning(msg)
+        # Insert "?" for all attributes
+        row.extend(len(path_attributes)*["?"])
+        continue
+      _append_columns(data, path_attributes, row)
+    logger.debug(f"  {len(row)} columns in row {len(table)}")
+    table.append(row)
 
-  datasets = copy.deepcopy(datasets)
+  return attribute_names, table
 
-  paths = attributes.keys()
 
-  for idx, dataset in enumerate(datasets):
-    logger.debug(f"  Computing {mode} for element {idx}")
+def _table_walk_parallel(datasets, attributes, config, collect=False):
+  """
+  Same as _table_walk() except that datasets are processed in chunks of
+  config['chunk_size'] (default CHUNK_SIZE) by config['workers'] processes
+  and table is an iterator of rows.
+
+  If collect=True, the attribute names found in each chunk are merged in
+  chunk order before rows are created, so the attributes dictionary and
+  columns are the same as for _table_walk(). Rows are yielded in the order
+  of datasets as chunks finish, so they can be written while later chunks
+  are processed.
+  """
+  import concurrent.futures
+
+  workers = config['workers']
+  chunk_size = config.get('chunk_size', CHUNK_SIZE)
+
+  omit_attributes = config.get('omit_attributes', None)
+  fixes = _table_fixes(config)
+
+  paths = [(path, path.split('/')) for path in attributes.keys()]
+  chunks = [(start, min(start + chunk_size, len(datasets))) for start in range(0, len(datasets), chunk_size)]
+
+  logger.info(f"Processing {len(datasets)} elements in {len(chunks)} chunks using {workers} processes")
+
+  # datasets are passed once per process instead of once per chunk (and are
+  # not copied if processes are started by fork).
+  initargs = (datasets, paths, fixes, omit_attributes, logger.name, logger.getEffectiveLevel())
+  pool = concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=_chunk_init, initargs=initargs)
+
+  attribute_names = None
+  try:
+    if collect:
+      attribute_names = []
+      chunk_attributes = len(chunks)*[{path: dict(attributes[path]) for path, _ in paths}]
+      for names, added in pool.map(_chunk_attributes, chunks, chunk_attributes):
+        attribute_names.extend(names)
+        for path in added:
+          for attribute in added[path]:
+            attributes[path][attribute] = None
+  except BaseException:
+    pool.shutdown(cancel_futures=True)
+    raise
+
+  columns = [(path, list(attributes[path])) for path, _ in paths]
+
+  def rows():
+    try:
+      for chunk_rows in pool.map(_chunk_rows, chunks, len(chunks)*[columns]):
+        yield from chunk_rows
+    finally:
+      pool.shutdown(cancel_futures=True)
+
+  return attribute_names, rows()
+
+
+def _chunk_init(datasets, paths, fixes, omit_attributes, logger_name, logger_level):
+  # Runs in each worker process of _table_walk_parallel()
+  import logging
+
+  logging.basicConfig()
+  globals()['logger'] = logging.getLogger(logger_name)
+  globals()['logger'].setLevel(logger_level)
+  globals()['_chunk'] = {
+    'datasets': datasets,
+    'paths': paths,
+    'fixes': fixes,
+    'omit_attributes': omit_attributes
+  }
+
 
-    if mode == 'rows':
-      row = []
+def _chunk_attributes(chunk, attributes):
+  # Returns attribute names found in datasets[chunk[0]:chunk[1]] and the
+  # attributes dictionary updated with them.
+  datasets, paths, fixes = _chunk['datasets'], _chunk['paths'], _chunk['fixes']
 
-    for path in paths:
+  attribute_names = []
+  for idx in range(*chunk):
+    for path, parts in paths:
+      data = utilrsw.get_path(datasets[idx], parts)
+      if data is not None:
+        _add_attributes(data, attributes[path], attribute_names, fixes, path, _chunk['omit_attributes'])
 
-      logger.debug(f"    Reading path = '{path}'")
+  return attribute_names, attributes
 
-      data = utilrsw.get_path(dataset, path.split('/'))
 
+def _chunk_rows(chunk, columns):
+  # Returns rows for datasets[chunk[0]:chunk[1]]
+  datasets, paths, fixes = _chunk['datasets'], _chunk['paths'], _chunk['fixes']
+
+  table = []
+  for idx in range(*chunk):
+    record = [utilrsw.get_path(datasets[idx], parts) for _, parts in paths]
+    row = []
+    for (path, _), (_, path_attributes), data in zip(paths, columns, _fix_record(record, fixes)):
       if data is None:
-        if mode == 'rows':
-          msg = f"    No path '{path}'. Using '?' for all attrib. vals."
-          logger.warning(msg)
-          # Insert "?" for all attributes
-          n_attribs = len(attributes[path])
-          fill = n_attribs*"?".split()
-          row = [*row, *fill]
+        msg = f"    No path '{path}'. Using '?' for all attrib. vals."
+        logger.warning(msg)
+        row.extend(len(path_attributes)*["?"])
         continue
+      _append_columns(data, path_attributes, row)
+    table.append(row)
 
-      if mode == 'attributes':
-        _add_attributes(data, attributes[path], attribute_names, fixes, path, omit_attributes)
-      else:
-        _append_columns(data, attributes[path], row, fixes)
+  return table
 
-    if mode == 'rows':
-      logger.debug(f"  {len(row)} columns in row {len(table)}")
-      table.append(row)
 
-  if mode == 'attributes':
-    return attribute_names
-  else:
-    return table
+def _table_fixes(config):
+
+  fixes = None
+  if 'fix_attributes' in config:
+    if config['fix_attributes']:
+      if 'fixes' in config:
+        logger.info("Using fixes found in config")
+        fixes = config['fixes']
+      else:
+        msg = "Error: 'fix_attributes' = True, but 'fixes' in config."
+        logger.error(msg)
 
+  return fixes
+
+
+def _fix_attributes(data, fixes):
+  # Return data with misspelled attribute names replaced. data is copied
+  # (shallow) only if it has a name to replace.
+  if fixes is None or fixes.keys().isdisjoint(data):
+    return data
+
+  data = dict(data)
+  for fix in fixes:
+    if fix in data:
+      data[fixes[fix]] = data[fix]
+      del data[fix]
+  return data
+
+
+def _fix_record(record, fixes):
+  # Return record (the data at each path of a dataset) with fixes applied.
+  # Datasets are not modified, so an object that is the data of one path
+  # and is also in the data of another path (e.g., "meta" in the data of
+  # "/") is replaced there by its fixed copy, as if fixed in place.
+  if fixes is None:
+    return record
+
+  copies = {}
+  fixed = []
+  for data in record:
+    if data is not None:
+      data_fixed = _fix_attributes(data, fixes)
+      if data_fixed is not data:
+        copies[id(data)] = data_fixed
+      data = data_fixed
+    fixed.append(data)
+
+  if len(copies) == 0:
+    return fixed
+  return [_fix_copies(data, copies) for data in fixed]
+
+
+def _fix_copies(value, copies):
+  # value with objects in it replaced by their copies in copies, which is
+  # keyed on id(object). Containers are copied only if something in them is
+  # replaced.
+  if isinstance(value, dict):
+    value = copies.get(id(value), value)
+    items = value.items()
+  elif isinstance(value, list):
+    items = enumerate(value)
+  else:
+    return value
 
-def _append_columns(data, attributes, row, fixes):
+  fixed = None
+  for key, item in items:
+    if isinstance(item, (dict, list)):
+      item_fixed = _fix_copies(item, copies)
+      if item_fixed is not item:
+        if fixed is None:
+          fixed = dict(value) if isinstance(value, dict) else list(value)
+        fixed[key] = item_fixed
+  return value if fixed is None else fixed
 
-  for attribute in attributes:
 
-    if fixes is not None:
-      for fix in fixes:
-        if fix in data:
-          data[fixes[fix]] = data[fix]
-          del data[fix]
+def _append_columns(data, attributes, row):
 
+  for attribute in attributes:
     if attribute in data:
       val = data[attribute]
       if isinstance(val, str) and val == " ":
@@ -190,8 +391,17 @@ def _add_attributes(data, attributes, attribute_names, fixes, path, omit_attribu
 
 
 def _write_files(name, config, out_dir, header, body, counts):
+  """
+  Write the files in config['outputs'] (default OUTPUTS). Each file is
+  written by a separate thread.
 
+  If body is an iterator, the SQLite file is written as rows are created
+  and the other files that need all rows are written after the last row.
+  """
   import os
+  import threading
+  import concurrent.futures
+
   import tableui
 
   files = {
@@ -203,31 +413,91 @@ def _write_files(name, config, out_dir, header, body, counts):
     'counts': f'{name}.attribute_counts.csv'
   }
 
+  outputs = config.get('outputs', OUTPUTS)
+  for output in outputs:
+    if output not in files:
+      raise ValueError(f"Invalid output '{output}'. Must be one of {list(files.keys())}")
+
   metadata = _table_metadata(name, config, header, files)
-  import pdb; pdb.set_trace()
+
+  # See tableui.sql.write()
+  sql_mode = config.get('sql_mode', 'replace')
+  sql_key = config.get('sql_key', None)
+
   for key in files:
     files[key] = os.path.join(out_dir, files[key])
 
-  if counts is None:
+  if counts is None and 'counts' in files:
     del files['counts']
-  else:
-    logger.info(f"Writing: {files['counts']}")
-    utilrsw.write(files['counts'], [["attribute", "count"], *counts])
-
-  logger.info(f"Writing: {files['meta']}")
-  utilrsw.write(files['meta'], metadata)
-
-  logger.info(f"Writing: {files['header']}")
-  utilrsw.write(files['header'], header)
-
-  logger.info(f"Writing: {files['body']}")
-  utilrsw.write(files['body'], body)
-
-  logger.info(f"Writing: {files['csv']}")
-  utilrsw.write(files['csv'], [header, *body])
-
-  logger.info(f"Writing: {files['sql']}")
-  tableui.sql.write(name, header, body, f"{files['sql']}", types=None, metadata=metadata, logger=logger, logger_indent="   ")
+  for key in list(files.keys()):
+    if key not in outputs:
+      del files[key]
+
+  writers = {
+    'counts': lambda: utilrsw.write(files['counts'], [["attribute", "count"], *counts]),
+    'meta': lambda: utilrsw.write(files['meta'], metadata),
+    'header': lambda: utilrsw.write(files['header'], header),
+    'body': lambda: utilrsw.write(files['body'], table),
+    'csv': lambda: utilrsw.write(files['csv'], [header, *table]),
+    'sql': lambda: tableui.sql.write(name, header, table, f"{files['sql']}", types=None, metadata=metadata, mode=sql_mode, key=sql_key, logger=logger, logger_indent="   ")
+  }
+  # Writers that need all rows
+  need_rows = ['body', 'csv', 'sql']
+
+  def write(key):
+    logger.info(f"Writing: {files[key]}")
+    writers[key]()
+    logger.info(f"Wrote: {files[key]}")
+
+  futures = []
+  with concurrent.futures.ThreadPoolExecutor(max_workers=len(files) or 1) as pool:
+    try:
+      for key in files:
+        if key not in need_rows:
+          futures.append(pool.submit(write, key))
+
+      table = body
+      streamed = False
+      if not isinstance(body, list):
+        table = []
+        if 'sql' in files:
+          # SQLite file is written as rows are appended to table
+          last_row = threading.Event()
+
+          def rows():
+            try:
+              for row in body:
+                table.append(row)
+                yield row
+            finally:
+              last_row.set()
+
+          def write_sql():
+            logger.info(f"Writing: {files['sql']}")
+            tableui.sql.write(name, header, rows(), f"{files['sql']}", types=None, metadata=metadata, mode=sql_mode, key=sql_key, logger=logger, logger_indent="   ")
+            logger.info(f"Wrote: {files['sql']}")
+
+          future = pool.submit(write_sql)
+          futures.append(future)
+          streamed = True
+          while not last_row.wait(0.1):
+            if future.done():
+              break
+          if future.done() and future.exception() is not None:
+            raise future.exception()
+        else:
+          table.extend(body)
+
+      for key in need_rows:
+        if key in files and not (key == 'sql' and streamed):
+          futures.append(pool.submit(write, key))
+
+      for future in futures:
+        future.result()
+    except BaseException:
+      for future in futures:
+        future.cancel()
+      raise
 
   return files
 
@@ -1,37 +1,44 @@
-def list2sql(table_name, body, head=None, types=None, out=None):
+# Number of characters read at a time from body files
+READ_SIZE = 2**20
+# Files with these extensions have one JSON array (row) per line
+NDJSON_EXTENSIONS = (".ndjson", ".jsonl")
+
+
+def list2sql(table_name, body, head=None, types=None, out=None, fts=None, indexes=None, infer=None, mode="replace", key=None):
+  import os
   import json
   import logging
+  import itertools
 
   import tableui
 
   logger = logging.getLogger(__name__)
   logging.basicConfig(level=logging.INFO)
 
+  # Rows are read as they are written to the SQLite file, so body files
+  # need not fit in memory.
   if isinstance(body, str):
-    with open(body) as f:
-      rows = json.load(f)
-      if not isinstance(rows, list):
-        raise ValueError(f"{body} must contain an array of arrays. Exiting.")
-        exit(1)
-      if len(rows) == 0:
-        raise ValueError(f"{body} contains no rows. Exiting.")
-        exit(1)
+    if body.endswith(NDJSON_EXTENSIONS):
+      rows = _ndjson_rows(body)
+    else:
+      rows = _json_rows(body)
+    rows = _check_rows(rows, f"{body} must contain an array of arrays. Exiting.")
   else:
-    rows = body
-    if not isinstance(rows, list):
+    if isinstance(body, (dict, str)) or not hasattr(body, '__iter__'):
       raise ValueError("body must be a list of lists. Exiting.")
       exit(1)
-    if len(rows) == 0:
-      raise ValueError("body contains no rows. Exiting.")
-      exit(1)
+    rows = _check_rows(iter(body), "body must be a list of lists. Exiting.")
 
-  if not all(isinstance(row, list) for row in rows):
-    raise ValueError("body must contain an array of arrays. Exiting.")
+  first = next(rows, None)
+  if first is None:
+    if isinstance(body, str):
+      raise ValueError(f"{body} contains no rows. Exiting.")
+    raise ValueError("body contains no rows. Exiting.")
     exit(1)
+  rows = itertools.chain([first], rows)
 
   if head is None:
-    if len(rows) > 0:
-      num_cols = len(rows[0])
+    num_cols = len(first)
     columns = [f"c{i}" for i in range(num_cols)]
   else:
     if isinstance(head, str):
@@ -43,20 +50,100 @@ def list2sql(table_name, body, head=None, types=None, out=None):
     else:
       columns = head
 
-  if len(columns) != len(rows[0]):
-    raise ValueError(f"Number of values in {head} ({len(columns)}) does not match number elements in first row of {body} ({len(rows[0])}). Exiting.")
+  if len(columns) != len(first):
+    raise ValueError(f"Number of values in {head} ({len(columns)}) does not match number elements in first row of {body} ({len(first)}). Exiting.")
     exit(1)
 
   out_path = out
   if out is None:
     if isinstance(body, str):
-      if body.endswith(".json"):
-        out_path = body.replace(".json", ".sqlite")
+      root, ext = os.path.splitext(body)
+      if ext in (".json", *NDJSON_EXTENSIONS):
+        out_path = root + ".sqlite"
       else:
         out_path = body + ".sqlite"
     else:
       out_path = "out.sqlite"
 
-  tableui.sql.write(table_name, columns, rows, out_path, types=types, logger=logger, logger_indent="   ")
+  tableui.sql.write(table_name, columns, rows, out_path, types=types, fts=fts, indexes=indexes, infer=infer, mode=mode, key=key, logger=logger, logger_indent="   ")
 
   return out_path
+
+
+def _check_rows(rows, emsg):
+  for row in rows:
+    if not isinstance(row, list):
+      raise ValueError(emsg)
+    yield row
+
+
+def _ndjson_rows(file):
+  import json
+
+  with open(file) as f:
+    for lineno, line in enumerate(f, 1):
+      if line.strip() == "":
+        continue
+      try:
+        yield json.loads(line)
+      except json.JSONDecodeError as e:
+        raise ValueError(f"Invalid JSON on line {lineno} of {file}: {e}") from e
+
+
+def _json_rows(file):
+  # Yield elements of the top-level JSON array in file. The file is read
+  # READ_SIZE characters at a time and elements are parsed with raw_decode(),
+  # so only the unparsed part of the file is kept in memory.
+  import json
+
+  decoder = json.JSONDecoder()
+  whitespace = " \t\n\r"
+
+  with open(file) as f:
+    buf, idx, eof = "", 0, False
+
+    def fill():
+      nonlocal buf, idx, eof
+      chunk = f.read(READ_SIZE)
+      buf, idx, eof = buf[idx:] + chunk, 0, len(chunk) == 0
+
+    def token():
+      # Next non-whitespace character; None at end of file
+      nonlocal idx
+      while True:
+        while idx < len(buf) and buf[idx] in whitespace:
+          idx += 1
+        if idx < len(buf):
+          return buf[idx]
+        if eof:
+          return None
+        fill()
+
+    if token() != "[":
+      raise ValueError(f"{file} must contain an array of arrays. Exiting.")
+    idx += 1
+    if token() == "]":
+      return
+
+    while True:
+      token()
+      while True:
+        try:
+          value, idx = decoder.raw_decode(buf, idx)
+          break
+        except json.JSONDecodeError as e:
+          # Element may continue past the end of buf
+          if eof:
+            raise ValueError(f"Invalid JSON in {file}: {e.msg}") from e
+          fill()
+      yield value
+
+      char = token()
+      if char == "]":
+        idx += 1
+        if token() is not None:
+          raise ValueError(f"Invalid JSON in {file}: extra data after array")
+        return
+      if char != ",":
+        raise ValueError(f"Invalid JSON in {file}: expected ',' or ']' after array element")
+      idx += 1
@@ -1,88 +1,591 @@
 
+import os
+import re
 import logging
+import threading
+import contextlib
+import collections
 logger = logging.getLogger(__name__)
 
-def write(name, header, body, file, types=None, metadata=None, logger=None, logger_indent="   "):
-  import os
-  import sqlite3
+# Default maximum number of open connections per database file
+POOL_SIZE = 4
+# Default maximum number of generators returned by iterate() per database
+# file. Each has its own connection, which is not one of the POOL_SIZE.
+STREAMS = 4
+# Number of prepared statements kept by each connection (see sqlite3.connect)
+CACHED_STATEMENTS = 256
+# Default number of rows in each list returned by iterate()
+BATCH_SIZE = 1000
+# Number of SQLite virtual machine instructions between checks of the
+# deadline set by timeout()
+PROGRESS_STEPS = 1000
+
+# Deadline (time.monotonic() value) set by timeout() for the current thread
+_DEADLINE = threading.local()
+
+# Default maximum size in bytes of a database copied into memory when
+# configure(..., memory=True) is used. Larger databases are read from the
+# file. SQLite limits the size of an in-memory copy to 1 GiB by default.
+MEMORY_LIMIT = 2**30
+
+# Options for connections used for queries set with configure(..., sqlite=...).
+# mode and immutable are URI parameters (https://sqlite.org/uri.html); the
+# others are pragmas. None means the SQLite default.
+SQLITE_OPTIONS = {
+  "mode": "ro",
+  "immutable": False,
+  "mmap_size": None,
+  "cache_size": None,
+  "temp_store": None,
+  "query_only": None
+}
+_SQLITE_PRAGMAS = ("mmap_size", "cache_size", "temp_store", "query_only")
+
+# Pools of read-only connections keyed by absolute path of database file
+_POOLS = {}
+_POOLS_LOCK = threading.Lock()
+
+# Maximum number of results kept by the LRU cache used by nrows()
+NROWS_CACHE_SIZE = 1024
+_NROWS_CACHE = collections.OrderedDict()
+_NROWS_CACHE_LOCK = threading.Lock()
+_NROWS_CACHE_STATS = {'hits': 0, 'misses': 0}
+
+# Default number of rows inserted per transaction by write()
+WRITE_BATCH_SIZE = 10000
+# Number of rows used by write(..., infer="sample") to infer column types
+INFER_SAMPLE_SIZE = 1000
+# Strings that infer_types() treats as numbers. Numbers with leading zeros
+# (e.g., ZIP codes) are not matched so they are kept as TEXT.
+_INTEGER_RE = re.compile(r"-?(0|[1-9][0-9]*)")
+_REAL_RE = re.compile(r"-?(0|[1-9][0-9]*)(\.[0-9]+)?([eE][-+]?[0-9]+)?")
+# Range of SQLite INTEGER values
+_INTEGER_MIN = -2**63
+_INTEGER_MAX = 2**63 - 1
+
+# Values of mode for write()
+WRITE_MODES = ("replace", "append", "upsert")
+
+# Settings used by write() while loading a new file. With the rollback
+# journal off, a crash leaves a corrupt file; write() removes the file
+# if loading fails and restores journaling when done.
+WRITE_PRAGMAS = {
+  "journal_mode": "OFF",
+  "synchronous": "OFF",
+  "cache_size": -262144,   # KiB (256 MiB)
+  "temp_store": "MEMORY",
+  "locking_mode": "EXCLUSIVE"
+}
 
+def write(name, header, body, file, types=None, metadata=None, fts=None, indexes=None, batch_size=None, infer=None, mode="replace", key=None, logger=None, logger_indent="   "):
+  """Write table `name` with columns `header` and rows `body` to SQLite file `file`.
+
+  body may be a list or any iterable of rows (e.g., a generator), so rows
+  need not all be in memory. Rows are inserted in transactions of
+  batch_size (default WRITE_BATCH_SIZE) rows.
+
+  mode is one of
+    "replace"  A new file is written to a temporary file with WRITE_PRAGMAS
+               in effect and indexes created after all rows are inserted.
+               The temporary file is then renamed to `file`, so readers of
+               an existing `file` see the old or new table but never a
+               partial one. If writing fails, `file` is not changed.
+    "append"   Rows are inserted into the table in an existing `file`.
+    "upsert"   Same as append, except that a row with the same values for
+               the `key` column(s) as an existing row replaces it.
+  For append and upsert, the types of the existing columns are used, existing
+  indexes are kept, and the full-text search table, if any, is updated by
+  the triggers added by create_fts(). If writing fails, batches inserted
+  before the failure are kept. If `file` does not exist, it is created as
+  for replace.
+
+  For replace, column types not given in types are TEXT unless infer is
+  "sample" (infer from the first INFER_SAMPLE_SIZE rows) or "all" (infer
+  from all rows; an iterator body is read into memory first). See
+  infer_types().
+  """
+
+  if logger is None:
+    logger = globals()['logger']
   indent = logger_indent
 
-  if os.path.exists(file):
-    logger.info(f"{indent}Removing existing SQLite database file '{file}'")
-    os.remove(file)
+  if batch_size is None:
+    batch_size = WRITE_BATCH_SIZE
 
-  column_types = _types(header, types)
+  if mode not in WRITE_MODES:
+    raise ValueError(f"mode must be one of {WRITE_MODES}. Got: {mode}")
+  if isinstance(key, str):
+    key = [key]
+  if mode == "upsert" and not key:
+    raise ValueError("key (a column name or list of column names) is required for mode='upsert'")
+  if mode != "upsert":
+    key = None
 
-  header, body = _prep(header, body, column_types, logger, logger_indent="   ")
+  if mode != "replace" and os.path.exists(file):
+    logger.info(f"{indent}Inserting rows into table {name} in '{file}' (mode = {mode})")
+    column_names = _write_existing(name, header, body, file, key, batch_size, logger, indent)
+    if indexes is not None:
+      create_indexes(file, name, indexes, column_names=column_names, logger=logger, logger_indent=logger_indent)
+    if fts and f"{name}.fts" not in _table_names(file):
+      create_fts(file, name, columns=None if fts is True else fts, logger=logger, logger_indent=logger_indent)
+    if metadata is not None:
+      _write_metadata(file, name, metadata, logger, indent)
+    return
+
+  file_tmp = f"{file}.{os.getpid()}.tmp"
+  if os.path.exists(file_tmp):
+    os.remove(file_tmp)
 
-  for hidx, colname in enumerate(header):
-    header[hidx] = f"`{colname}`"
+  try:
+    column_names = _write_new(name, header, body, file_tmp, types, infer, key, indexes, batch_size, logger, indent)
+    if indexes is not None:
+      create_indexes(file_tmp, name, indexes, column_names=column_names, logger=logger, logger_indent=logger_indent)
+    if fts:
+      create_fts(file_tmp, name, columns=column_names if fts is True else fts, logger=logger, logger_indent=logger_indent)
+    if metadata is not None:
+      _write_metadata(file_tmp, name, metadata, logger, indent)
+  except BaseException:
+    logger.error(f"{indent}Writing '{file_tmp}' failed. Removing it.")
+    if os.path.exists(file_tmp):
+      os.remove(file_tmp)
+    raise
 
-  column_names = f"({', '.join(header)})"
-  column_spec  = "(" + ", ".join(f"{col} {t}" for col, t in zip(header, column_types.values())) + ")"
-  column_vals  = f"({', '.join(len(header)*['?'])})"
+  logger.info(f"{indent}Renaming '{file_tmp}' to '{file}'")
+  os.replace(file_tmp, file)
 
-  execute = f'INSERT INTO `{name}` {column_names} VALUES {column_vals}'
+
+def _write_new(name, header, body, file, types, infer, key, indexes, batch_size, logger, indent):
+  # Create table in new file. Returns column names.
+  import sqlite3
+
+  # List of types by position because names in header may repeat (repeated
+  # names are renamed by _prep())
+  type_map = _types(header, types)
+  if isinstance(types, list):
+    column_types = [t.upper() for t in types]
+  else:
+    column_types = [type_map[column] for column in header]
+
+  if infer is not None:
+    body, inferred = _infer(header, body, infer, logger, logger_indent=indent)
+    explicit = set(header) if isinstance(types, list) else set(types or {})
+    for j, column_type in enumerate(inferred):
+      if header[j] not in explicit:
+        column_types[j] = column_type
+
+  header, body = _prep(header, body, column_types, logger, batch_size=batch_size, logger_indent="   ")
+
+  column_spec  = "(" + ", ".join(f"`{col}` {t}" for col, t in zip(header, column_types)) + ")"
   create  = f'CREATE TABLE `{name}` {column_spec}'
 
   logger.debug(f"{indent}Creating and connecting to file '{file}'")
-  conn = sqlite3.connect(file)
+  conn = sqlite3.connect(file, isolation_level=None)
   logger.debug(f"{indent}Done")
 
-  logger.info(f"{indent}Getting cursor from connection to '{file}'")
-  cursor = conn.cursor()
-  logger.debug(f"{indent}Done")
+  try:
+    for pragma, value in WRITE_PRAGMAS.items():
+      logger.debug(f"{indent}Executing: PRAGMA {pragma} = {value}")
+      conn.execute(f"PRAGMA {pragma} = {value}")
 
-  logger.debug(f"{indent}Creating table using cursor.execute('{create}')")
-  cursor.execute(create)
-  logger.debug(f"{indent}Done")
+    logger.debug(f"{indent}Creating table using execute('{create}')")
+    conn.execute(create)
+    logger.debug(f"{indent}Done")
 
-  logger.info(f"{indent}Inserting rows")
-  logger.debug(f"{indent}using cursor.executemany('{execute}', body)")
-  cursor.executemany(execute, body)
-  logger.debug(f"{indent}Done")
+    if key is not None:
+      # Needed for ON CONFLICT
+      conn.execute(_index_create(name, _index_key(key, header)))
 
-  logger.debug(f"{indent}Executing: connection.commit()")
-  conn.commit()
-  logger.debug(f"{indent}Done")
+    _insert(conn, name, header, body, key, batch_size, logger, indent)
+
+    if indexes is None:
+      index = f"CREATE INDEX idx0 ON `{name}` (`{header[0]}`)"
+      logger.debug(f"{indent}Creating index using execute('{index}')")
+      conn.execute(index)
+      logger.debug(f"{indent}Done")
+
+    # Restore settings so that later writes to the file are journaled
+    conn.execute("PRAGMA journal_mode = DELETE")
+    conn.execute("PRAGMA synchronous = FULL")
+  finally:
+    conn.close()
+
+  return header
+
+
+def _write_existing(name, header, body, file, key, batch_size, logger, indent):
+  # Insert or upsert rows into table in existing file. Returns column names.
+  import sqlite3
+
+  conn = sqlite3.connect(file, isolation_level=None)
+  try:
+    table_info = conn.execute(f"PRAGMA table_info(`{name}`)").fetchall()
+    if len(table_info) == 0:
+      raise ValueError(f"No table '{name}' in '{file}'")
+    declared = {row[1]: (row[2] or 'TEXT').upper() for row in table_info}
+
+    header = _unique_names(header, logger, indent)
+    for column in header:
+      if column not in declared:
+        raise ValueError(f"Column '{column}' is not in table '{name}' in '{file}'. Columns: {list(declared)}")
+    column_types = [declared[column] for column in header]
+
+    header, body = _prep(header, body, column_types, logger, batch_size=batch_size, logger_indent=indent)
+
+    if key is not None:
+      # Needed for ON CONFLICT. Fails if table has rows with the same key.
+      conn.execute(_index_create(name, _index_key(key, header)))
+
+    _insert(conn, name, header, body, key, batch_size, logger, indent)
+
+    conn.execute("PRAGMA optimize")
+  finally:
+    conn.close()
+
+  return header
 
-  if header is not None:
-    index = f"CREATE INDEX idx0 ON `{name}` ({header[0]})"
-    logger.debug(f"{indent}Creating index using cursor.execute('{index}')")
-    cursor.execute(index)
-    logger.debug(f"{indent}Done")
 
-    logger.debug(f"{indent}Executing: commit()")
+def _insert(conn, name, header, body, key, batch_size, logger, indent):
+  import time
+
+  columns = ", ".join(f"`{column}`" for column in header)
+  values = ", ".join(len(header)*["?"])
+  execute = f"INSERT INTO `{name}` ({columns}) VALUES ({values})"
+  if key is not None:
+    target = ", ".join(f"`{column}`" for column in key)
+    updates = [f"`{column}` = excluded.`{column}`" for column in header if column not in key]
+    if updates:
+      execute += f" ON CONFLICT ({target}) DO UPDATE SET {', '.join(updates)}"
+    else:
+      execute += f" ON CONFLICT ({target}) DO NOTHING"
+
+  logger.info(f"{indent}Inserting rows in batches of {batch_size}")
+  logger.debug(f"{indent}using executemany('{execute}', batch)")
+  start = time.time()
+  nrows = 0
+  for batch in body:
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+      conn.executemany(execute, batch)
+    except BaseException:
+      conn.execute("ROLLBACK")
+      raise
+    conn.execute("COMMIT")
+    nrows += len(batch)
+    logger.debug(f"{indent}Inserted {nrows} rows")
+  dt = "{:.2f} [s]".format(time.time() - start)
+  logger.info(f"{indent}Inserted {nrows} rows and {len(header)} columns in {dt}")
+
+
+def _index_key(key, column_names):
+  return _index_specs([{'columns': key, 'unique': True}], column_names)[0]
+
+
+def _table_names(file):
+  import sqlite3
+  conn = sqlite3.connect(file)
+  try:
+    return [row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type='table'")]
+  finally:
+    conn.close()
+
+
+def _write_metadata(file, name, metadata, logger, indent):
+  import json
+  import sqlite3
+
+  conn = sqlite3.connect(file)
+  try:
+    name_desc = f'{name}.metadata'
+    logger.info(f"{indent}Writing table {name_desc} with table metadata stored as a JSON string")
+
+    spec = "(TableName TEXT NOT NULL, Metadata TEXT)"
+    execute = f"CREATE TABLE IF NOT EXISTS `{name_desc}` {spec}"
+    logger.debug(f"{indent}Executing: {execute}")
+    conn.execute(execute)
+    conn.execute(f"DELETE FROM `{name_desc}`")
+
+    insert = f'INSERT INTO `{name_desc}` ("TableName", "Metadata") VALUES (?, ?)'
+    logger.debug(f"{indent}Executing: connection.execute('{insert})'")
+    conn.execute(insert, (name_desc, json.dumps(metadata)))
+    conn.commit()
+    logger.debug(f"{indent}Done.")
+  finally:
+    conn.close()
+
+
+def create_fts(file, name, columns=None, logger=None, logger_indent="   "):
+  """Create a full-text search index for table `name` in SQLite file `file`.
+
+  The index is an external content FTS5 table named `{name}.fts` over
+  `columns` (all columns if None). It uses the trigram tokenizer so that
+  MATCH '"term"' finds the same rows as LIKE '%term%' for terms with three
+  or more characters. An existing index is replaced.
+  """
+  import sqlite3
+
+  if logger is None:
+    logger = globals()['logger']
+  indent = logger_indent
+
+  name_fts = f"{name}.fts"
+
+  conn = sqlite3.connect(file)
+  try:
+    if columns is None:
+      columns = [row[1] for row in conn.execute(f"PRAGMA table_info(`{name}`)")]
+    if len(columns) == 0:
+      raise ValueError(f"No columns to index. Is '{name}' a table in '{file}'?")
+
+    column_spec = ", ".join([f"`{column}`" for column in columns])
+    content = name.replace("'", "''")
+    create = f"CREATE VIRTUAL TABLE `{name_fts}` USING fts5({column_spec}, "
+    create += f"content='{content}', tokenize='trigram')"
+
+    logger.info(f"{indent}Creating full-text search table {name_fts} for {len(columns)} columns")
+    for trigger in _fts_triggers(name, columns):
+      conn.execute(f"DROP TRIGGER IF EXISTS `{trigger}`")
+    conn.execute(f"DROP TABLE IF EXISTS `{name_fts}`")
+    logger.debug(f"{indent}Executing: {create}")
+    try:
+      conn.execute(create)
+    except sqlite3.OperationalError as e:
+      emsg = f"Could not create FTS5 table with trigram tokenizer (SQLite {sqlite3.sqlite_version}; "
+      emsg += f"FTS5 and SQLite >= 3.34 required): {e}"
+      raise RuntimeError(emsg) from e
+
+    logger.info(f"{indent}Indexing rows of {name}")
+    conn.execute(f"INSERT INTO `{name_fts}`(`{name_fts}`) VALUES('rebuild')")
+
+    # Keep index up-to-date when rows are added, changed, or removed (e.g.,
+    # by write(..., mode="append"))
+    for trigger, create in _fts_triggers(name, columns).items():
+      logger.debug(f"{indent}Creating trigger {trigger}")
+      conn.execute(create)
     conn.commit()
     logger.debug(f"{indent}Done")
+  finally:
+    conn.close()
 
-  conn.close()
 
-  if metadata is None:
-    return
+def _fts_triggers(name, columns):
+  # Triggers that update external content FTS5 table when table changes
+  name_fts = f"{name}.fts"
+  columns_fts = ", ".join([f"`{column}`" for column in columns])
+  new = ", ".join([f"new.`{column}`" for column in columns])
+  old = ", ".join([f"old.`{column}`" for column in columns])
+  insert = f"INSERT INTO `{name_fts}`(rowid, {columns_fts}) VALUES (new.rowid, {new});"
+  delete = f"INSERT INTO `{name_fts}`(`{name_fts}`, rowid, {columns_fts}) VALUES ('delete', old.rowid, {old});"
+  return {
+    f"{name_fts}.insert": f"CREATE TRIGGER `{name_fts}.insert` AFTER INSERT ON `{name}` BEGIN {insert} END",
+    f"{name_fts}.delete": f"CREATE TRIGGER `{name_fts}.delete` AFTER DELETE ON `{name}` BEGIN {delete} END",
+    f"{name_fts}.update": f"CREATE TRIGGER `{name_fts}.update` AFTER UPDATE ON `{name}` BEGIN {delete} {insert} END"
+  }
+
+
+def create_indexes(file, name, indexes, column_names=None, logger=None, logger_indent="   "):
+  """Create indexes on table `name` in SQLite file `file`.
+
+  Each element of indexes is one of
+    "a"              index on column a
+    ["a", "b"]       composite index on columns a and b
+    "*"              one index for each column
+    {"columns": ["a", "b"], "include": ["c"], "collate": "NOCASE", "unique": False}
+                     composite index on a and b using NOCASE collation
+                     with column c added so that queries that only need a,
+                     b, and c are answered from the index (covering index).
+                     "columns": "*" means one such index for each column.
+  Existing indexes with the same name are kept. ANALYZE is run afterwards
+  so that the query planner has statistics for choosing between indexes.
+  """
+  import sqlite3
+
+  if logger is None:
+    logger = globals()['logger']
+  indent = logger_indent
 
   conn = sqlite3.connect(file)
-  cursor = conn.cursor()
-  name_desc = f'{name}.metadata'
-  logger.info(f"{indent}Creating table {name_desc} with table metadata stored as a JSON string")
-
-  spec = "(TableName TEXT NOT NULL, Metadata TEXT)"
-  execute = f"CREATE TABLE `{name_desc}` {spec}"
-  logger.debug(f"{indent}Executing: {execute}")
-  conn.execute(execute)
-  logger.debug(f"{indent}Done")
+  try:
+    if column_names is None:
+      column_names = [row[1] for row in conn.execute(f"PRAGMA table_info(`{name}`)")]
+
+    specs = _index_specs(indexes, column_names)
+    for spec in specs:
+      create = _index_create(name, spec)
+      logger.info(f"{indent}Creating index {_index_name(name, spec)}")
+      logger.debug(f"{indent}Executing: {create}")
+      conn.execute(create)
+
+    logger.info(f"{indent}Executing: ANALYZE")
+    conn.execute(f"ANALYZE `{name}`")
+    conn.commit()
+    logger.debug(f"{indent}Done")
+  finally:
+    conn.close()
+
+
+def _index_specs(indexes, column_names):
+  # Normalize elements of indexes given to create_indexes() to dicts
+
+  valid_keys = {'columns', 'include', 'collate', 'unique', 'name'}
+
+  specs = []
+  for index in indexes:
+    if isinstance(index, str):
+      index = {'columns': index if index == "*" else [index]}
+    elif isinstance(index, list):
+      index = {'columns': index}
+    elif not isinstance(index, dict):
+      raise ValueError(f"Index must be a string, list, or dict. Got: {index}")
+
+    for key in index:
+      if key not in valid_keys:
+        raise ValueError(f"Invalid key '{key}' in index {index}. Allowed: {valid_keys}")
+
+    columns = index.get('columns', None)
+    if columns == "*":
+      for column in column_names:
+        specs.extend(_index_specs([{**index, 'columns': [column], 'name': None}], column_names))
+      continue
+    if isinstance(columns, str):
+      columns = [columns]
+    if not columns:
+      raise ValueError(f"Index {index} has no columns")
+
+    include = index.get('include', None) or []
+    for column in [*columns, *include]:
+      if column not in column_names:
+        raise ValueError(f"Index column '{column}' not found in columns: {column_names}")
 
+    collate = index.get('collate', None)
+    if collate is not None:
+      collate = collate.upper()
+      if collate not in {'BINARY', 'NOCASE', 'RTRIM'}:
+        raise ValueError(f"Invalid collate '{collate}'. Must be BINARY, NOCASE, or RTRIM.")
+
+    specs.append({
+      'columns': list(columns),
+      'include': list(include),
+      'collate': collate,
+      'unique': bool(index.get('unique', False)),
+      'name': index.get('name', None)
+    })
+
+  return specs
+
+
+def _index_name(name, spec):
+  if spec['name'] is not None:
+    return spec['name']
+  index_name = f"{name}.idx." + ".".join(spec['columns'])
+  if spec['include']:
+    index_name += ".include." + ".".join(spec['include'])
+  if spec['collate'] is not None:
+    index_name += f".{spec['collate'].lower()}"
+  if spec['unique']:
+    index_name += ".unique"
+  return index_name
+
+
+def _index_create(name, spec):
+  collate = f" COLLATE {spec['collate']}" if spec['collate'] else ""
+  columns = [f"`{column}`{collate}" for column in spec['columns']]
+  columns += [f"`{column}`" for column in spec['include']]
+  unique = "UNIQUE " if spec['unique'] else ""
+  index_name = _index_name(name, spec)
+  return f"CREATE {unique}INDEX IF NOT EXISTS `{index_name}` ON `{name}` ({', '.join(columns)})"
+
+
+def advise(file, name, query_log, max_indexes=5):
+  """Propose indexes for table `name` based on a log of /data/ queries.
+
+  query_log is a file written by the server when the table config has a
+  'query_log' file name. Each line is a JSON object describing a query:
+  {"table": ..., "orders": [...], "searches": {column: operator},
+  "globalsearch": true|false, "uniques": [...]}.
+
+  Returns a list of (spec, count) tuples, most used first, where spec can
+  be passed to create_indexes() and count is the number of logged queries
+  that the index would serve. Indexes that are already served by an
+  existing index (same leading columns and collation) are omitted.
+  """
   import json
-  metadata = json.dumps(metadata)
-  metadata = metadata.replace("'","''")
-  values = f"('{name_desc}', '{metadata}')"
-  insert = f'INSERT INTO `{name_desc}` ("TableName", "Metadata") VALUES {values}'
-  logger.debug(f"{indent}Executing: connection.execute('{insert})'")
-  conn.execute(insert)
-  logger.debug(f"{indent}Done.")
-  conn.commit()
-  conn.close()
+  import sqlite3
+
+  ranges = ['>', '>=', '<', '<=']
+
+  counts = collections.Counter()
+  with open(query_log) as f:
+    for line in f:
+      line = line.strip()
+      if not line:
+        continue
+      try:
+        shape = json.loads(line)
+      except ValueError:
+        logger.warning(f"Skipping invalid line in {query_log}: {line[0:80]}")
+        continue
+      if shape.get('table', None) != name:
+        continue
+
+      searches = shape.get('searches', None) or {}
+      orders = shape.get('orders', None) or []
+
+      for column in shape.get('uniques', None) or []:
+        # GROUP BY column
+        counts[((column,), None)] += 1
+
+      # Equality constraints first, then at most one range constraint or, if
+      # none, the ORDER BY columns.
+      columns = sorted([col for col, op in searches.items() if op == '='])
+      range_cols = [col for col, op in searches.items() if op in ranges]
+      if range_cols:
+        columns.append(range_cols[0])
+      else:
+        for order in orders:
+          column = order[1:] if order.startswith("-") else order
+          if column not in columns:
+            columns.append(column)
+      if columns:
+        counts[(tuple(columns), None)] += 1
+
+      # LIKE 'x%' can use an index only if its collation is NOCASE
+      for column in [col for col, op in searches.items() if op == 'prefix']:
+        counts[((column,), 'NOCASE')] += 1
+
+  conn = sqlite3.connect(file)
+  try:
+    existing = []
+    for index in conn.execute(f"PRAGMA index_list(`{name}`)").fetchall():
+      info = conn.execute(f"PRAGMA index_xinfo(`{index[1]}`)").fetchall()
+      # Key columns; cid = -1 is the rowid
+      info = [row for row in info if row[5] == 1 and row[1] >= 0]
+      existing.append(([row[2] for row in info], [row[4] for row in info]))
+  finally:
+    conn.close()
+
+  def covered(columns, collate, indexes):
+    collate = collate or 'BINARY'
+    for index_columns, index_collates in indexes:
+      if tuple(index_columns[0:len(columns)]) != columns:
+        continue
+      if all(c.upper() == collate for c in index_collates[0:len(columns)]):
+        return True
+    return False
+
+  proposed = []
+  chosen = []
+  for (columns, collate), count in counts.most_common():
+    if covered(columns, collate, existing) or covered(columns, collate, chosen):
+      continue
+    chosen.append((list(columns), [collate or 'BINARY']*len(columns)))
+    spec = {'columns': list(columns)}
+    if collate is not None:
+      spec['collate'] = collate
+    proposed.append((spec, count))
+    if len(proposed) == max_indexes:
+      break
+
+  return proposed
 
 
 def _types(columns, types):
@@ -111,150 +614,509 @@ def _types(columns, types):
   return type_map
 
 
-def _prep(header, body, types, logger, logger_indent="   "):
-  import time
+def infer_types(header, rows):
+  """Return list of SQLite types for columns given rows (a list of lists).
 
-  indent = logger_indent
+  A column is INTEGER if all of its values are int or strings of digits
+  without leading zeros, REAL if all values are int, float, or strings
+  that look like decimal numbers, and TEXT otherwise. A column with an
+  integer outside the range of SQLite INTEGER (e.g., a 20-digit ID) is TEXT
+  unless it is already REAL. None values are ignored; a column with only
+  None values is TEXT.
+  """
+  return [_infer_column(row[j] for row in rows) for j in range(len(header))]
+
+
+def _infer_column(values):
+  column_type = None
+  for val in values:
+    if val is None:
+      continue
+    if isinstance(val, bool):
+      return 'TEXT'
+    if column_type in (None, 'INTEGER'):
+      if isinstance(val, int) or (isinstance(val, str) and _INTEGER_RE.fullmatch(val)):
+        if not _integer_fits(val):
+          # Digits would be lost if stored as REAL
+          return 'TEXT'
+        column_type = 'INTEGER'
+        continue
+    if isinstance(val, (int, float)) or (isinstance(val, str) and _REAL_RE.fullmatch(val)):
+      column_type = 'REAL'
+      continue
+    return 'TEXT'
+  return column_type or 'TEXT'
 
-  def unique(header):
 
-    headerlc = [val.lower() for val in header]
-    headeru = header.copy()
-    for val in header:
-      indices = [i for i, x in enumerate(headerlc) if x == val.lower()]
-      if len(indices) > 1:
-        dups = [header[i] for i in indices]
-        logger.warning(f"{indent}Duplicate column names when cast to lower case: {str(dups)}.")
-        logger.warning(f"{indent}Renaming duplicates by appending _$DUPLICATE_NUMBER$ to the column name.")
-        for r, idx in enumerate(indices):
-          if r > 0:
-            newname = header[idx] + "_$" + str(r) + "$"
-            logger.info(f"{indent}Renaming {header[idx]} to {newname}")
-            headeru[idx] = newname
-    return headeru
+def _integer_fits(val):
+  # True if int val or string of digits val is in the range of SQLite INTEGER
+  if isinstance(val, str) and len(val) > len(str(_INTEGER_MIN)):
+    return False
+  return _INTEGER_MIN <= int(val) <= _INTEGER_MAX
 
 
+def _integer(val):
+  # int(val), which raises OverflowError if not in the range of SQLite INTEGER
+  val = int(val)
+  if not _INTEGER_MIN <= val <= _INTEGER_MAX:
+    raise OverflowError(f"{val} is out of range of SQLite INTEGER")
+  return val
+
+
+def _infer(header, body, infer, logger, logger_indent="   "):
+  import itertools
+
+  if infer == "all":
+    if not isinstance(body, list):
+      body = list(body)
+    sample = body
+  elif infer == "sample":
+    body = iter(body)
+    sample = list(itertools.islice(body, INFER_SAMPLE_SIZE))
+    body = itertools.chain(sample, body)
+  else:
+    raise ValueError(f"infer must be None, 'sample', or 'all'. Got: {infer}")
+
+  logger.info(f"{logger_indent}Inferring column types from {len(sample)} rows")
+  inferred = infer_types(header, sample)
+  logger.debug(f"{logger_indent}Inferred types: {dict(zip(header, inferred))}")
+
+  return body, inferred
+
+
+def _cast(values, col_type):
+  # Cast a column of values. The cast function is applied to the whole column
+  # at once; only if a value fails are values cast one at a time, with values
+  # that cannot be cast kept as strings. None is NULL in non-TEXT columns.
+  cast_fn = _TYPE_CAST.get(col_type, str)
+  try:
+    if col_type == 'TEXT' or None not in values:
+      column = list(map(cast_fn, values))
+      if col_type == 'INTEGER' and column:
+        if min(column) < _INTEGER_MIN or max(column) > _INTEGER_MAX:
+          raise OverflowError("Value out of range of SQLite INTEGER")
+      return column
+  except (ValueError, TypeError, OverflowError):
+    pass
+
+  if col_type == 'INTEGER':
+    cast_fn = _integer
+
+  column = []
+  for val in values:
+    if val is None and col_type != 'TEXT':
+      column.append(None)
+      continue
+    try:
+      column.append(cast_fn(val))
+    except (ValueError, TypeError, OverflowError):
+      column.append(str(val))
+  return column
+
+
+_TYPE_CAST = {
+  'TEXT':    str,
+  'INTEGER': int,
+  'REAL':    float,
+  'NUMERIC': float,
+  'BLOB':    lambda x: x,
+}
+
+
+def _unique_names(header, logger, indent):
+
   logger.info(f"{indent}Renaming non-unique column names")
-  header = unique(header)
+  headerlc = [val.lower() for val in header]
+  headeru = list(header)
+  for val in header:
+    indices = [i for i, x in enumerate(headerlc) if x == val.lower()]
+    if len(indices) > 1:
+      dups = [header[i] for i in indices]
+      logger.warning(f"{indent}Duplicate column names when cast to lower case: {str(dups)}.")
+      logger.warning(f"{indent}Renaming duplicates by appending _$DUPLICATE_NUMBER$ to the column name.")
+      for r, idx in enumerate(indices):
+        if r > 0:
+          newname = header[idx] + "_$" + str(r) + "$"
+          logger.info(f"{indent}Renaming {header[idx]} to {newname}")
+          headeru[idx] = newname
   logger.info(f"{indent}Renamed non-unique column names")
 
-  type_cast = {
-    'TEXT':    str,
-    'INTEGER': int,
-    'REAL':    float,
-    'NUMERIC': float,
-    'BLOB':    lambda x: x,
-  }
-  col_types_list = list(types.values()) if types else []
+  return headeru
 
-  logger.info(f"{indent}Casting table elements using column types.")
-  start = time.time()
-  for i, row in enumerate(body):
-    for j, val in enumerate(row):
-      col_type = col_types_list[j] if j < len(col_types_list) else 'TEXT'
-      cast_fn = type_cast.get(col_type, str)
-      try:
-        body[i][j] = cast_fn(val)
-      except (ValueError, TypeError):
-        body[i][j] = str(val)
 
-  dt = "{:.2f} [s]".format(time.time() - start)
-  logger.info(f"{indent}Cast table elements in {len(body)} rows and {len(header)} columns in {dt}")
+def _prep(header, body, types, logger, batch_size=None, logger_indent="   "):
+  import time
+  import operator
+  import itertools
+
+  indent = logger_indent
+
+  header = _unique_names(header, logger, indent)
+
+  if batch_size is None:
+    batch_size = WRITE_BATCH_SIZE
+
+  col_types_list = list(types) if types else []
+  col_types_list += (len(header) - len(col_types_list))*['TEXT']
+
+  def cast(body):
+    start = time.time()
+    nrows = 0
+    while True:
+      batch = list(itertools.islice(body, batch_size))
+      if len(batch) == 0:
+        break
+      lengths = set(map(len, batch))
+      if lengths != {len(header)}:
+        emsg = f"Rows {nrows} to {nrows + len(batch) - 1} have {lengths - {len(header)}} "
+        emsg += f"values; expected {len(header)} (number of columns)."
+        raise ValueError(emsg)
+      columns = []
+      for j, col_type in enumerate(col_types_list):
+        columns.append(_cast(list(map(operator.itemgetter(j), batch)), col_type))
+      nrows += len(batch)
+      yield list(zip(*columns))
+
+    dt = "{:.2f} [s]".format(time.time() - start)
+    logger.info(f"{indent}Cast table elements in {nrows} rows and {len(header)} columns in {dt}")
+
+  # Rows are cast as they are consumed, one batch at a time, so that body
+  # need not be in memory. Returned body is an iterator of batches of rows.
+  logger.info(f"{indent}Casting table elements using column types.")
+  body = cast(iter(body))
 
   return header, body
 
 
-def _cursor(sqldb, memory=False):
-  import os
+def configure(sqldb, pool_size=None, memory=False, memory_limit=None, sqlite=None, streams=None):
+  """Set options used for connections to sqldb.
+
+  At most pool_size (default POOL_SIZE) connections are used by execute()
+  and functions that use it, and at most streams (default STREAMS) by
+  generators returned by iterate().
+
+  sqlite is a dict with keys in SQLITE_OPTIONS, e.g.,
+  {"immutable": True, "mmap_size": 268435456}. Use immutable=True only if
+  sqldb is not modified in place (write(..., mode="replace") renames a new
+  file over it, which is safe).
+
+  If memory=True, sqldb is copied into memory the first time it is queried
+  and again after it changes. Queries from all threads then read the copy.
+  If sqldb is larger than memory_limit bytes (default MEMORY_LIMIT), it is
+  read from the file instead.
+
+  If the options differ from those of the existing pool for sqldb, a new
+  pool is created and connections in the old pool are closed when released.
+  """
+  path = os.path.abspath(sqldb)
+  settings = _settings(pool_size=pool_size, memory=memory, memory_limit=memory_limit, sqlite=sqlite, streams=streams)
+  if settings['pool_size'] < 1:
+    raise ValueError(f"pool_size must be >= 1. Got {settings['pool_size']}.")
+  if settings['streams'] < 1:
+    raise ValueError(f"streams must be >= 1. Got {settings['streams']}.")
+  if settings['memory_limit'] < 0:
+    raise ValueError(f"memory_limit must be >= 0. Got {settings['memory_limit']}.")
+
+  with _POOLS_LOCK:
+    pool = _POOLS.get(path, None)
+    if pool is not None and pool['settings'] == settings:
+      return
+    if pool is not None:
+      logger.info(f"Connection options for '{path}' changed. Replacing pool.")
+      _pool_close(pool)
+    _POOLS[path] = _pool_new(settings)
+
+
+def _settings(pool_size=None, memory=False, memory_limit=None, sqlite=None, streams=None):
+  return {
+    'pool_size': POOL_SIZE if pool_size is None else int(pool_size),
+    'streams': STREAMS if streams is None else int(streams),
+    'memory': bool(memory),
+    'memory_limit': MEMORY_LIMIT if memory_limit is None else int(memory_limit),
+    'sqlite': _sqlite_options(sqlite)
+  }
+
+
+def _sqlite_options(sqlite):
+  options = dict(SQLITE_OPTIONS)
+  if sqlite is None:
+    return options
+  if not isinstance(sqlite, dict):
+    raise ValueError(f"sqlite options must be a dict. Got {type(sqlite).__name__}.")
+
+  for option, value in sqlite.items():
+    if option not in SQLITE_OPTIONS:
+      raise ValueError(f"Unknown sqlite option '{option}'. Allowed: {list(SQLITE_OPTIONS)}.")
+    if value is None:
+      continue
+    if option == "mode" and value not in ("ro", "rw"):
+      raise ValueError(f"sqlite mode must be 'ro' or 'rw'. Got {value!r}.")
+    if option in ("immutable", "query_only") and not isinstance(value, bool):
+      raise ValueError(f"sqlite {option} must be true or false. Got {value!r}.")
+    if option in ("mmap_size", "cache_size") and (isinstance(value, bool) or not isinstance(value, int)):
+      raise ValueError(f"sqlite {option} must be an integer. Got {value!r}.")
+    if option == "temp_store":
+      value = str(value).upper()
+      if value not in ("DEFAULT", "FILE", "MEMORY"):
+        raise ValueError(f"sqlite temp_store must be 'default', 'file', or 'memory'. Got {sqlite[option]!r}.")
+    options[option] = value
+
+  return options
+
+
+def _pool_new(settings):
+  return {
+    'settings': settings,
+    'version': None,
+    # In-memory copy of the file when settings['memory'] is True
+    'memory': None,
+    'idle': [],
+    'closed': False,
+    'lock': threading.Lock(),
+    'slots': threading.BoundedSemaphore(settings['pool_size']),
+    'streams': threading.BoundedSemaphore(settings['streams'])
+  }
+
+
+def _pool_close(pool):
+  with pool['lock']:
+    pool['closed'] = True
+    idle = pool['idle']
+    pool['idle'] = []
+    memory = pool['memory']
+    pool['memory'] = None
+  for connection in idle:
+    connection.close()
+  if memory is not None:
+    # Connections in use keep the copy open until they are released
+    memory['connection'].close()
+
+
+def _pool(path):
+  with _POOLS_LOCK:
+    if path not in _POOLS:
+      _POOLS[path] = _pool_new(_settings())
+    return _POOLS[path]
+
+
+def _version(path):
+  # Changes when the file is modified or replaced (e.g., by write())
+  stat = os.stat(path)
+  return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+
+def _connect(path, settings, memory=None):
   import sqlite3
-  import threading
-  # memory = True not well tested.
-  #  Seems much slower for small and fast queries and
-  #  ~3x faster for large and complex queries.
-  if not memory:
-    connection = sqlite3.connect(sqldb)
-    cursor = connection.cursor()
+  import pathlib
+
+  options = settings['sqlite']
+  if memory is None:
+    uri = f"{pathlib.Path(path).as_uri()}?mode={options['mode']}"
+    if options['immutable']:
+      uri += "&immutable=1"
   else:
-    try:
-      # Open the file-based DB and a fresh in-memory DB
-      file_conn = sqlite3.connect(sqldb)
-      mem_conn = sqlite3.connect(":memory:")
-      # Copy the whole file DB into memory
-      # Simple module-level cache to avoid re-copying unchanged DB files into memory
-      if '_MEMORY_DB_CACHE' not in globals():
-        _MEMORY_DB_CACHE = {}
-        _MEMORY_DB_LOCK = threading.Lock()
-      else:
-        _MEMORY_DB_CACHE = globals()['_MEMORY_DB_CACHE']
-        _MEMORY_DB_LOCK = globals()['_MEMORY_DB_LOCK']
+    uri = f"file:{memory['name']}?vfs=memdb&mode=ro"
+  logger.debug(f"  Opening connection to {uri}")
+  kwargs = {
+    'uri': True,
+    # Connections are used by one thread at a time, but not always the same one
+    'check_same_thread': False,
+    'cached_statements': CACHED_STATEMENTS
+  }
+  connection = sqlite3.connect(uri, **kwargs)
+  try:
+    for pragma in _SQLITE_PRAGMAS:
+      value = options[pragma]
+      if value is None:
+        continue
+      if isinstance(value, bool):
+        value = int(value)
+      logger.debug(f"  Executing: PRAGMA {pragma} = {value}")
+      connection.execute(f"PRAGMA {pragma} = {value}")
+  except Exception:
+    connection.close()
+    raise
+  return connection
 
-      file_path = os.path.abspath(sqldb)
-      try:
-        mtime = os.path.getmtime(file_path)
-      except Exception:
-        mtime = None
-
-      # If we've already copied this exact file (same mtime), reuse the in-memory connection
-      with _MEMORY_DB_LOCK:
-        cache_entry = _MEMORY_DB_CACHE.get(file_path)
-        if cache_entry is not None and cache_entry[0] == mtime:
-          connection = cache_entry[1]
-          cursor = connection.cursor()
-          return cursor, connection
-
-      # Otherwise create a fresh in-memory DB (closing any stale cached connection)
-      if cache_entry is not None:
-        try:
-          cache_entry[1].close()
-        except Exception:
-          pass
-        with _MEMORY_DB_LOCK:
-          _MEMORY_DB_CACHE.pop(file_path, None)
 
-      try:
-        # Open the file-based DB and a fresh in-memory DB, then copy
-        logger.info(f"Copying database '{sqldb}' into memory")
-        file_conn = sqlite3.connect(sqldb)
-        mem_conn = sqlite3.connect(":memory:")
-        file_conn.backup(mem_conn)
-        file_conn.close()
-        connection = mem_conn
-        cursor = mem_conn.cursor()
-        # Cache the new in-memory DB keyed by absolute path and current mtime
-        with _MEMORY_DB_LOCK:
-          _MEMORY_DB_CACHE[file_path] = (mtime, mem_conn)
-      except Exception:
-        # Ensure any opened connections are closed on error
-        try:
-          file_conn.close()
-        except Exception:
-          pass
-        try:
-          mem_conn.close()
-        except Exception:
-          pass
-        raise
-    except Exception:
-      # Ensure any opened connections are closed on error
-      try:
-        file_conn.close()
-      except Exception:
-        pass
-      try:
-        mem_conn.close()
-      except Exception:
-        pass
-      raise
+def _memory_load(path, version, settings):
+  # Copy the database into a named in-memory database that all connections
+  # in this process can open. The copy exists while any connection to it,
+  # including the one returned here, is open. Returns None if the database
+  # is too large to copy.
+  import time
+  import sqlite3
+  import hashlib
+
+  size = version[2]
+  if size > settings['memory_limit']:
+    logger.warning(f"  '{path}' is larger than memory_limit ({size} > {settings['memory_limit']} bytes). Reading from file.")
+    return None
+
+  start = time.time()
+  # memdb names must start with "/" to be shared by connections
+  name = f"/tableui-{hashlib.sha1(repr((path, version)).encode()).hexdigest()}"
+  connection = None
+  source = None
+  try:
+    # Fails if SQLite has no memdb VFS (before version 3.36)
+    connection = sqlite3.connect(f"file:{name}?vfs=memdb", uri=True, check_same_thread=False)
+    source = _connect(path, settings)
+    source.backup(connection)
+  except sqlite3.Error as e:
+    if connection is not None:
+      connection.close()
+    logger.warning(f"  Could not copy '{path}' into memory: {e}. Reading from file.")
+    return None
+  finally:
+    if source is not None:
+      source.close()
+
+  dt = "{:.4f}".format(time.time() - start)
+  logger.info(f"  Copied '{path}' ({size} bytes) into memory in {dt} [s]")
+  return {'name': name, 'connection': connection}
 
-  return cursor, connection
+
+@contextlib.contextmanager
+def timeout(seconds):
+  """Limit the time of queries executed by this thread in a with block.
+
+  When the time from entering the block exceeds seconds, the query being
+  executed is interrupted and execute(), iterate(), etc. raise TimeoutError.
+  seconds=None means no limit. Rows fetched from a generator returned by
+  iterate() in other threads are not limited.
+  """
+  import time
+
+  previous = getattr(_DEADLINE, 'value', None)
+  _DEADLINE.value = None if seconds is None else time.monotonic() + seconds
+  try:
+    yield
+  finally:
+    _DEADLINE.value = previous
+
+
+def _progress_handler():
+  # Non-zero return value interrupts the query
+  import time
+  deadline = getattr(_DEADLINE, 'value', None)
+  return deadline is not None and time.monotonic() > deadline
+
+
+def _timed_out(e):
+  # True if exception e is due to an interrupt by _progress_handler()
+  return str(e) == "interrupted" and bool(_progress_handler())
+
+
+def _acquire(semaphore):
+  # Wait for semaphore until the deadline set by timeout(), if any
+  import time
+
+  deadline = getattr(_DEADLINE, 'value', None)
+  if deadline is None:
+    semaphore.acquire()
+  elif not semaphore.acquire(timeout=max(0, deadline - time.monotonic())):
+    raise TimeoutError("Query time limit exceeded while waiting for a connection")
+
+
+def _pool_sync(pool, path, version, idle=True):
+  # Close idle connections (and reload the in-memory copy) if the file
+  # changed since the pool was last used. Returns (idle connection or None
+  # if idle=False or there is none, in-memory copy or None).
+  connection = None
+  stale = []
+  with pool['lock']:
+    if pool['version'] != version:
+      if pool['version'] is not None:
+        logger.info(f"  '{path}' changed. Closing idle connections.")
+      stale = pool['idle']
+      pool['idle'] = []
+      pool['version'] = version
+      if pool['memory'] is not None:
+        stale.append(pool['memory']['connection'])
+        pool['memory'] = None
+      if pool['settings']['memory']:
+        # Loaded while holding the lock so that other threads wait for
+        # the copy instead of making their own.
+        pool['memory'] = _memory_load(path, version, pool['settings'])
+    if idle and pool['idle']:
+      connection = pool['idle'].pop()
+    memory = pool['memory']
+  for connection_stale in stale:
+    connection_stale.close()
+  return connection, memory
+
+
+@contextlib.contextmanager
+def _connection(sqldb):
+  # Borrow a read-only connection to sqldb from its pool. Blocks if
+  # pool_size connections are already in use.
+  path = os.path.abspath(sqldb)
+  version = _version(path)
+  pool = _pool(path)
+
+  _acquire(pool['slots'])
+  try:
+    connection, memory = _pool_sync(pool, path, version)
+    if connection is None:
+      connection = _connect(path, pool['settings'], memory)
+  except Exception:
+    pool['slots'].release()
+    raise
+
+  deadline = getattr(_DEADLINE, 'value', None)
+  if deadline is not None:
+    connection.set_progress_handler(_progress_handler, PROGRESS_STEPS)
+
+  try:
+    yield connection
+  finally:
+    if deadline is not None:
+      connection.set_progress_handler(None, 0)
+    with pool['lock']:
+      reuse = not pool['closed'] and pool['version'] == version
+      if reuse:
+        pool['idle'].append(connection)
+    if not reuse:
+      connection.close()
+    pool['slots'].release()
+
+
+@contextlib.contextmanager
+def _stream_connection(sqldb):
+  # Read-only connection to sqldb used by one generator returned by
+  # iterate(). It is not one of the pool's pool_size connections, so a
+  # client that reads a stream slowly does not delay other queries. Blocks
+  # if streams such connections are already open.
+  path = os.path.abspath(sqldb)
+  version = _version(path)
+  pool = _pool(path)
+
+  _acquire(pool['streams'])
+  try:
+    _, memory = _pool_sync(pool, path, version, idle=False)
+    connection = _connect(path, pool['settings'], memory)
+  except Exception:
+    pool['streams'].release()
+    raise
+
+  deadline = getattr(_DEADLINE, 'value', None)
+  if deadline is not None:
+    connection.set_progress_handler(_progress_handler, PROGRESS_STEPS)
+
+  try:
+    yield connection
+  finally:
+    connection.close()
+    pool['streams'].release()
 
 
 def execute(sqldb, query, params=None):
 
   import time
+  import sqlite3
 
   start = time.time()
-  cursor, connection = _cursor(sqldb, memory=False)
 
   logger.info("  Executing")
   logger.info(f"  {query}")
@@ -262,13 +1124,19 @@ def execute(sqldb, query, params=None):
       logger.info("  with parameters:")
       logger.info(f"  {params}")
   logger.info("  and fetching all results from")
-  logger.info(f"  {sqldb if sqldb is not None else 'existing connection'}")
-  if params:
-      result = cursor.execute(query, params)
-  else:
-      result = cursor.execute(query)
-  data = result.fetchall()
-  connection.close()
+  logger.info(f"  {sqldb}")
+  with _connection(sqldb) as connection:
+    try:
+      if params:
+          cursor = connection.execute(query, params)
+      else:
+          cursor = connection.execute(query)
+      data = cursor.fetchall()
+      cursor.close()
+    except sqlite3.OperationalError as e:
+      if _timed_out(e):
+        raise TimeoutError("Query time limit exceeded") from e
+      raise
   dt = "{:.4f} [s]".format(time.time() - start)
   n_rows = len(data)
   n_cols = len(data[0]) if n_rows > 0 else 0
@@ -277,6 +1145,58 @@ def execute(sqldb, query, params=None):
   return data
 
 
+def iterate(sqldb, query, params=None, size=None):
+  """Execute query and return a generator of lists of at most size rows.
+
+  The query is executed before returning, so errors in it are raised here.
+  A connection that is not shared with execute() is held until the
+  generator is exhausted or closed (see configure(..., streams=...)).
+  """
+  import sys
+  import sqlite3
+
+  size = BATCH_SIZE if size is None else size
+
+  logger.info("  Executing")
+  logger.info(f"  {query}")
+  if params:
+      logger.info("  with parameters:")
+      logger.info(f"  {params}")
+  logger.info(f"  and fetching results in batches of {size} rows from")
+  logger.info(f"  {sqldb}")
+
+  context = _stream_connection(sqldb)
+  connection = context.__enter__()
+  try:
+    if params:
+        cursor = connection.execute(query, params)
+    else:
+        cursor = connection.execute(query)
+  except BaseException as e:
+    context.__exit__(*sys.exc_info())
+    if isinstance(e, sqlite3.OperationalError) and _timed_out(e):
+      raise TimeoutError("Query time limit exceeded") from e
+    raise
+
+  def batches():
+    try:
+      # The generator is advanced to here before it is returned so that the
+      # finally clause runs if it is closed or garbage collected unused.
+      yield None
+      while True:
+        rows = cursor.fetchmany(size)
+        if not rows:
+          break
+        yield rows
+    finally:
+      cursor.close()
+      context.__exit__(None, None, None)
+
+  generator = batches()
+  next(generator)
+  return generator
+
+
 def table_names(sqldb):
 
   query = "SELECT name FROM sqlite_master WHERE type='table';"
@@ -290,16 +1210,94 @@ def column_names(sqldb, table_name):
   return [row[1] for row in data] if data else []
 
 
-def uniques(sqldb, table_name, column_name, clause=None, params=None):
+def uniques(sqldb, table_name, column_name, clause=None, params=None, limit=None):
+  """Unique values and their counts for one or more columns.
+
+  If column_name is a string, returns a list of (value, count) tuples. If it
+  is a list, returns a dict with a list for each column. If limit is given,
+  only the limit most frequent values of each column are returned, most
+  frequent first. All columns are computed by a single query. For more
+  than one column, the (filtered) rows of the columns are read from the
+  table once and shared by all columns.
+  """
+  import sqlite3
+
+  columns = column_name if isinstance(column_name, list) else [column_name]
   clause = clause if clause else ""
-  query = f"SELECT `{column_name}`, COUNT(*) as count FROM `{table_name}` "
-  query += f"{clause} GROUP BY `{column_name}`"
+  params = list(params) if params else []
+
+  if len(columns) > 1:
+    materialized = "MATERIALIZED " if sqlite3.sqlite_version_info >= (3, 35, 0) else ""
+    columns_str = ", ".join([f"`{col}`" for col in set(columns)])
+    query = f"WITH `filtered` AS {materialized}"
+    query += f"(SELECT {columns_str} FROM `{table_name}` {clause}) "
+    source = "`filtered`"
+    source_clause = ""
+  else:
+    query = ""
+    source = f"`{table_name}`"
+    source_clause = clause
+
+  parts = []
+  for idx, col in enumerate(columns):
+    part = f"SELECT {idx} AS idx, `{col}` AS value, COUNT(*) AS count "
+    part += f"FROM {source} {source_clause} GROUP BY `{col}`"
+    if limit is not None:
+      part += f" ORDER BY count DESC, value LIMIT {int(limit)}"
+    parts.append(f"SELECT * FROM ({part})")
+  query += " UNION ALL ".join(parts)
+  if limit is not None:
+    query += " ORDER BY idx, count DESC, value"
+  else:
+    query += " ORDER BY idx, value"
+
   data = execute(sqldb, query, params=params)
-  return [(row[0], row[1]) for row in data] if data else []
+
+  result = {col: [] for col in columns}
+  for row in data:
+    result[columns[row[0]]].append((row[1], row[2]))
+
+  if isinstance(column_name, list):
+    return result
+  return result[column_name]
 
 
 def nrows(sqldb, table_name, clause=None, params=None):
+  # Results are cached until the database file changes (see _version())
   clause_str = clause if clause else ""
+  path = os.path.abspath(sqldb)
+  key = (path, _version(path), table_name, " ".join(clause_str.split()), tuple(params or ()))
+
+  with _NROWS_CACHE_LOCK:
+    if key in _NROWS_CACHE:
+      _NROWS_CACHE.move_to_end(key)
+      _NROWS_CACHE_STATS['hits'] += 1
+      return _NROWS_CACHE[key]
+    _NROWS_CACHE_STATS['misses'] += 1
+
   query = f"SELECT COUNT(*) FROM `{table_name}` {clause_str}"
   data = execute(sqldb, query, params=params)
-  return data[0][0] if data else 0
\ No newline at end of file
+  n = data[0][0] if data else 0
+
+  with _NROWS_CACHE_LOCK:
+    _NROWS_CACHE[key] = n
+    while len(_NROWS_CACHE) > NROWS_CACHE_SIZE:
+      _NROWS_CACHE.popitem(last=False)
+
+  return n
+
+
+def nrows_cache_info():
+  with _NROWS_CACHE_LOCK:
+    return {
+      **_NROWS_CACHE_STATS,
+      'size': len(_NROWS_CACHE),
+      'maxsize': NROWS_CACHE_SIZE
+    }
+
+
+def nrows_cache_clear():
+  with _NROWS_CACHE_LOCK:
+    _NROWS_CACHE.clear()
+    _NROWS_CACHE_STATS['hits'] = 0
+    _NROWS_CACHE_STATS['misses'] = 0